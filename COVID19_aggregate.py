@@ -0,0 +1,44 @@
+# Shared aggregation stage for the COVID19_analysis scripts.
+# Rolls the JHU cases table up to one row per country in a single vectorized pass and joins it onto a country table.
+
+import numpy as np
+import pandas as pd
+
+# Case columns summed for each country, when present in the cases table
+CASE_COLUMNS = ["Confirmed", "Deaths", "Recovered", "Active"]
+
+# Returns a table indexed by Country_Region with the summed case columns
+# If countries is given, only those countries are kept (and every one of them appears, with zeros if it has no rows)
+def aggregateCases(cases, countries = None, columns = None):
+    if columns is None:
+        columns = [column for column in CASE_COLUMNS if column in cases.columns]
+    totals = cases.groupby("Country_Region", observed = True, sort = True)[columns].sum()
+    # Country_Region may be categorical; plain labels let totals from different tables be added and reindexed freely
+    if isinstance(totals.index, pd.CategoricalIndex):
+        totals.index = pd.Index(np.asarray(totals.index), name = "Country_Region")
+    if countries is not None:
+        totals = totals.reindex(sorted(countries), fill_value = 0)
+    return totals
+
+# Joins the per-country totals onto a table with a "country" column
+# columnMap maps a totals column to the column of countryData it fills (by default Confirmed -> numCases)
+def joinCases(countryData, totals, columnMap = None):
+    if columnMap is None:
+        columnMap = {"Confirmed" : "numCases"}
+    for source, target in columnMap.items():
+        countryData[target] = countryData["country"].map(totals[source]).fillna(0).to_numpy()
+    return countryData
+
+# Sums the case totals of each country into the value it maps to (for example its projected temperature)
+def totalsByKey(totals, countryToKey, column = "Confirmed"):
+    keys = pd.Series(countryToKey)
+    values = totals[column].reindex(keys.index, fill_value = 0)
+    return values.groupby(keys.to_numpy()).sum()
+
+# Builds a table with one row per name and zero-filled columns of the given dtypes, in one allocation per column
+# columns maps column name -> dtype, in the order the columns should appear
+def countryTable(names, columns):
+    data = {"country" : list(names)}
+    for column, dtype in columns.items():
+        data[column] = np.zeros(len(data["country"]), dtype = dtype)
+    return pd.DataFrame(data)
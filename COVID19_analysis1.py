@@ -1,9 +1,15 @@
 import pandas as pd
 import numpy as np
-from urllib.request import urlretrieve
-import requests
-import plotly.express as px
-import country_converter as coco
+import io
+import COVID19_fetch as fetch
+import COVID19_climate as climate
+import COVID19_aggregate as agg
+import COVID19_ingest as ingest
+import COVID19_store as store
+import COVID19_report as report
+import COVID19_pipeline as pipeline
+import COVID19_countries as countryIds
+import COVID19_binning as binning
 
 
 # Pulls an updated list of COVID-19 cases from JHU CSSE repo
@@ -12,71 +18,44 @@ def pullCovidData():
     print("Pulling COVID-19 data from the web...")
     global cases
     cases_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
-    urlretrieve(cases_URL, 'cases.csv')
-    cases = pd.read_csv('cases.csv')
+    cases = ingest.readCases(io.BytesIO(fetch.fetchURL(cases_URL)))
     print("COVID-19 data retrieved.")
 
-# Pulls projected March temperature (in degrees Celcius) from the World Bank's Climate Data API
+# Looks up projected March temperature (in degrees Celcius) for every country in climateTable (see COVID19_climate)
 def pullTempData():
 
-    print("Pulling temperature data from the web...")
+    print("Looking up temperature data...")
     global countries
 
-    # Using a set eliminates duplicate countries in our dataset
-    countries = set(cases["Country_Region"])
-
-    # Eliminating countries without a valid ISO3 code
-    countries.discard("Cruise Ship")
-    countries.discard("Holy See")
-    countries.discard("Kosovo")
-    countries.discard("Diamond Princess")
+    # Keeping only regions that map to a country (no cruise ships), resolved to ISO3 codes in one batch
+    names, ISOs = countryIds.countriesWithISO3(cases["Country_Region"])
+    countries = set(names)
 
     # Declaring a dictionary that matches country to projected March temperature
     global country_to_temp
     country_to_temp = {}
 
-    # Filling the dictionary with results from the World Bank API
-    for country in countries:
-        if country == "US":
-            ISO = "usa"
-            temp_URL = 'http://climatedataapi.worldbank.org/climateweb/rest/v1/country/mavg/tas/2020/2039/' + ISO.lower() + '.CSV'
-            urlretrieve(temp_URL, 'temps.csv')
-            temps = pd.read_csv('temps.csv')
-            temp = temps.at[1, "Mar"]
-            country_to_temp[country] = temp
-        elif str(country) != 'nan':
-            ISO = coco.convert(names = [country], to = 'ISO3')
-            temp_URL = 'http://climatedataapi.worldbank.org/climateweb/rest/v1/country/mavg/tas/2020/2039/' + ISO.lower() + '.CSV'
-            urlretrieve(temp_URL, 'temps.csv')
-            temps = pd.read_csv('temps.csv')
-            temp = temps.at[1, "Mar"]
-            country_to_temp[country] = temp
-
-    print("Temperature data retrieved.")
+    # Filling the dictionary from the climate table
+    # Countries we could not get a temperature for are left out of the analysis
+    temps = climate.monthTemps(climateTable, ISOs, "Mar")
+    for country, temp in zip(names, temps):
+        if np.isnan(temp):
+            countries.discard(country)
+        else:
+            country_to_temp[country] = float(temp)
+
+    print("Temperature data found.")
 
 def tempAnalysis():
 
     print("Analyzing temperatures...")
 
     # Declaring a dataframe that stores temperature and corresponding number of COVID-19 cases
+    # Cases are summed per country in one pass, then per projected temperature
     global tempData
-    tempData = pd.DataFrame(columns = ["temp", "numCases"])
-    tempData.set_index('temp')
-
-    #presetting TempData
-    # - all temps equal to their temps
-    # - all numCases equal to zero
-    for country in countries:
-        if str(country) != "nan":
-            tempData.at[country_to_temp[country], "temp"] = country_to_temp[country]
-            tempData.at[country_to_temp[country], "numCases"] = 0
-
-    # Filling TempData with projected temperature and number of cases for each country
-    for ind in cases.index:
-        country = cases.at[ind, "Country_Region"]
-        if country != "Holy See" and country != "Cruise Ship" and country != "Kosovo" and country != "Diamond Princess" and str(country) != "nan":
-            temp = country_to_temp[country]
-            tempData.at[temp, "numCases"] = tempData.at[temp, "numCases"] + cases.at[ind, "Confirmed"]
+    totals = agg.aggregateCases(cases, country_to_temp.keys())
+    byTemp = agg.totalsByKey(totals, country_to_temp)
+    tempData = pd.DataFrame({"temp" : byTemp.index, "numCases" : byTemp.to_numpy()}, index = byTemp.index)
 
     print("Temperature analysis complete.")
 
@@ -84,75 +63,81 @@ def tempAnalysis():
 def aggregateTempData():
 
     # agTempData stores total number of confirmed cases in a range of temperature
+    # (5 degree ranges from -30 to 30, temperatures beyond either end counted in the end ranges)
     global agTempData
-    agTempData = pd.DataFrame(columns = ["startTemp", "numCases"])
-    agTempData.set_index("startTemp")
-
-    # Initializing agTempData
-    for i in range(-30, 31, 5):
-        agTempData.at[i, "startTemp"] = i
-        agTempData.at[i, "numCases"] = 0
-
-    # Iterating through each temperature, populating agTempData
-    for ind in tempData.index:
-        agTempData.at[findStartTemp(ind), "numCases"] = agTempData.at[findStartTemp(ind), "numCases"] + tempData.at[ind, "numCases"]
-
-# Given temperature, returns first temperature in the range the given temperature corresponds to
-def findStartTemp(temp):
-    for i in range(-30, 29, 5):
-        if (temp - i >= 0 and temp - (i + 5) < 0):
-            return i
-    return 30
+    spec = binning.widthResolution(-30, 30, 5, clip = True)
+    sums = binning.binSums(tempData["temp"], {"numCases" : tempData["numCases"]}, spec)
+    agTempData = pd.DataFrame({"startTemp" : spec["labels"], "numCases" : sums["numCases"]})
 
 # Plots agTempData using plotly express
 def plotTempData():
+    import plotly.express as px
     print("Plotting temperature data...")
     fig = px.bar(agTempData, x = "startTemp", y = "numCases")
-    fig.write_html("COVID-19_graphs.html")
+    report.addFigure(fig, "Confirmed cases by projected March temperature")
     print("Graph generated.")
 
     # fig = px.scatter(x = tempData["temp"], y = tempData["numCases"], range_x = [-30, 30])
-    # fig.write_html("COVID-19_graphs.html")
+    # report.addFigure(fig)
 
 # Sorts data into a table with distance from equator, percentage of population that tested positive for COVID-19
-def latitudeAnalysis():
+# resolution is the width of each distance band in degrees (for example 0.1, 0.5 or 1)
+def latitudeAnalysis(resolution = 1.0):
 
     print("Sorting data by distance from equator...")
     global latData
-    latData = pd.DataFrame(columns = ["distance", "numCases"])
-    latData.set_index('distance')
-
-    # Initializing latData
-    for d in range(91):
-        latData.at[d, "distance"] = d
-        latData.at[d, 'numCases'] = 0
-
-
-    for ind in cases.index:
-        if (str(cases.at[ind, "Lat"]) != "nan"):
-            dist = abs(int(cases["Lat"][ind]))
-            if (0 <= dist) and (90 >= dist):
-                latData.at[dist, "numCases"] = int(latData.at[dist, "numCases"]) + cases.at[ind, "Confirmed"]
-
+    latData = binning.latitudeHistogram(cases, resolution)
     print("Sorting complete.")
 
 
 # Plots latData using plotly express
 def plotLatData():
+    import plotly.express as px
     print("Plotting latitude data...")
     fig = px.scatter(latData, x = "distance", y = "numCases", range_x = [0, 90])
-    fig.write_html("COVID-19_graphs.html")
+    report.addFigure(fig, "Confirmed cases by distance from the equator")
+    print("Graph generated.")
+
+# Grids confirmed cases and incidence by latitude and longitude
+def latLongAnalysis(resolution = 1.0):
+
+    print("Gridding data by latitude and longitude...")
+    global latLongData
+    latLongData = binning.latLongGrid(cases, resolution)
+    print("Gridding complete.")
+
+# Plots latLongData as a heatmap of incidence using plotly express
+def plotLatLongData():
+    import plotly.express as px
+    print("Plotting latitude and longitude data...")
+    latCentres = (latLongData["latEdges"][:-1] + latLongData["latEdges"][1:]) / 2
+    longCentres = (latLongData["longEdges"][:-1] + latLongData["longEdges"][1:]) / 2
+    fig = px.imshow(latLongData["incidence"], x = longCentres, y = latCentres, origin = "lower", labels = {"x" : "Longitude", "y" : "Latitude", "color" : "Proportion diagnosed"})
+    report.addFigure(fig, "Proportion diagnosed by latitude and longitude")
     print("Graph generated.")
 
+# Saves the projected temperature of each country and the raw cases to today's snapshot in the columnar store
+def saveSnapshot():
+    temps = pd.DataFrame({"country" : list(country_to_temp), "temp" : list(country_to_temp.values())})
+    store.writeSnapshot({"countryTemps" : temps, "cases" : cases})
+
+# Loads the temperatures and raw cases from a stored snapshot (memory-mapped) instead of pulling them from the web
+def loadSnapshot(date):
+    print("Loading snapshot " + str(date) + "...")
+    global cases
+    global countries
+    global country_to_temp
+    cases = store.openSnapshot("cases", date)
+    temps = store.openSnapshot("countryTemps", date)
+    country_to_temp = dict(zip(temps["country"], temps["temp"]))
+    countries = set(country_to_temp)
+    print("Snapshot loaded.")
+
 def main():
 
-    pullCovidData()
-    pullTempData()
-    tempAnalysis()
-    aggregateTempData()
-    plotTempData()
-    latitudeAnalysis()
-    plotLatData()
+    # Stages run through the shared pipeline, which skips any whose inputs have not changed since the last run
+    options = fetch.parseArgs()
+    pipeline.runTargets(["temperature-cases", "latitude"], options)
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,19 @@
 # Script for generating bar graphs and scatterplots, with x-axis corresponding to temperature and y-axis corresponding to proportion of population diagnosed with coronavirus.
 # Created by Claire Murphy, 3/27/20
 
-import pandas as pd
 import numpy as np
-from urllib.request import urlretrieve
-import requests
-import plotly.express as px
-import country_converter as coco
 import json
+import io
+import COVID19_fetch as fetch
+import COVID19_checkpoint as checkpoint
+import COVID19_climate as climate
+import COVID19_aggregate as agg
+import COVID19_ingest as ingest
+import COVID19_store as store
+import COVID19_report as report
+import COVID19_pipeline as pipeline
+import COVID19_countries as countryIds
+import COVID19_binning as binning
 
 # Pulls an updated list of COVID-19 cases from a JHU CSSE repo
 def pullCovidData():
@@ -15,144 +21,112 @@ def pullCovidData():
     print("Pulling COVID-19 data from the web...")
     global cases
     cases_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
-    urlretrieve(cases_URL, 'cases.csv')
-    cases = pd.read_csv('cases.csv')
+    cases = ingest.readCases(io.BytesIO(fetch.fetchURL(cases_URL)))
     print("COVID-19 data retrieved.")
 
 # Created dataframe which will store average March temperature, population, and number of diagnosed COVID-19 cases for each country
 def createDataFrame():
 
     print("Creating dataframe...")
-    # Using a set eliminates duplicate countries in our dataset
+    # Keeping only regions that map to a country (no cruise ships), resolved to ISO3 codes in one batch
     global countries
-    countries = set(cases["Country_Region"])
-
-    # Eliminating countries without a valid ISO3 code
-    countries.discard("Cruise Ship")
-    countries.discard("Holy See")
-    countries.discard("Kosovo")
-    countries.discard("Diamond Princess")
-    countries.discard("MS Zaandam")
+    names = countryIds.countriesWithISO3(cases["Country_Region"])[0]
+    countries = set(names)
 
     # Creating the dataframe
     global countryData
-    countryData = pd.DataFrame(columns = ["country", "temp", "population", "numCases"])
-    for country in countries:
-        if str(country) != "nan":
-            countryData = countryData.append({'country' : country, 'temp' : 0, 'population' : 0, 'numCases' : 0}, ignore_index=True)
+    countryData = agg.countryTable(names, {"temp" : np.float64, "population" : np.int64, "numCases" : np.int64})
 
     print("Dataframe created.")
 
-# Pulls projected March temperature (in degrees Celcius) from the World Bank's Climate Data API
-# Pulls population size from REST Countries API
+# Pulls population size from REST Countries API for a single country
+def fillCountry(country):
+    ISO = countryIds.lookupISO3(country)
+
+    # Retrieving population size from REST Countries API
+    pop_URL = "https://restcountries.eu/rest/v2/alpha/" + ISO.lower()
+    country_info = json.loads(fetch.fetchURL(pop_URL))
+    pop = country_info["population"]
+
+    return {"population" : pop}
+
+# Fills in projected March temperature (in degrees Celcius) for every country from climateTable (see COVID19_climate),
+# and population with fillCountry
 # Pulls number of COVID-19 cases from our "cases" dataframe
 def fillDataFrame():
 
     print("Filling data frame...")
 
-    for ind in countryData.index:
-        country = countryData.at[ind, "country"]
-        if country == "US":
-            ISO = "usa"
-        else:
-            ISO = coco.convert(names = [country], to = 'ISO3')
-
-        # Retrieving average March temperature
-        temp_URL = 'http://climatedataapi.worldbank.org/climateweb/rest/v1/country/mavg/tas/2020/2039/' + ISO.lower() + '.CSV'
-        urlretrieve(temp_URL, 'temps.csv')
-        temps = pd.read_csv('temps.csv')
-        temp = temps.at[1, "Mar"]
-        countryData.at[ind, "temp"] = temp
-
-        # Retrieving population size from REST Countries API
-        pop_URL = "https://restcountries.eu/rest/v2/alpha/" + ISO.lower()
-        r = requests.get(pop_URL)
-        country_info = json.loads(r.text)
-        pop = country_info["population"]
-        countryData.at[ind, "population"] = pop
-
-        # Updating user on status (this part of the code takes a while...)
-        print(countryData.at[ind, "country"], " ", countryData.at[ind, "temp"], " ", countryData.at[ind, "population"], " (", str(ind + 1), "/", str(len(countryData.index)), ')')
-
-    # Adds coronavirus cases to each country
-    for ind in cases.index:
-        country = cases.at[ind, 'Country_Region']
-        # Making sure our "country" is one of the countries we can actually get data on...
-        if country != "Holy See" and country != "Cruise Ship" and country != "Kosovo" and country != "Diamond Princess" and str(country) != "nan":
-            countryData.loc[countryData["country"] == country, "numCases"] = cases.at[ind, "Confirmed"] + countryData.loc[countryData["country"] == country, "numCases"]
+    # Countries are fetched concurrently and checkpointed as they complete (this part of the code takes a while...)
+    results, errors = checkpoint.runCheckpointed("analysis2_fill", countryData["country"], fillCountry)
+    temps = climate.monthTemps(climateTable, [countryIds.lookupISO3(country) for country in countryData["country"]], "Mar")
 
-    print("Data frame filled.")
+    # Dropping countries we could not get data for
+    failed = ~countryData["country"].isin(list(results)).to_numpy() | np.isnan(temps)
+    if failed.any():
+        countryData.drop(countryData.index[failed], inplace = True)
+        countryData.reset_index(drop = True, inplace = True)
 
-# Calculates proportion of COVID-19 cases for each temperature range
-def barTempAnalysis():
+    # Results are written back in the same order as countryData
+    countryData["temp"] = temps[~failed]
+    countryData["population"] = [results[country]["population"] for country in countryData["country"]]
 
-    # barTempData stores total number of confirmed cases in a range of temperatures
-    global barTempData
-    barTempData = pd.DataFrame(columns = ["temp", "numCases", "totalPop", "density"])
-    for i in range(-30, 31, 5):
-        barTempData = barTempData.append({'temp' : i, 'numCases' : 0, 'totalPop' : 0, 'density' : 0}, ignore_index=True)
+    # Adds coronavirus cases to each country
+    agg.joinCases(countryData, agg.aggregateCases(cases, countryData["country"]))
 
-    # Iterates through each country, adding COVID-19 cases and population to the correct temperature range
-    for ind in countryData.index:
-        startTemp = findStartTemp(countryData.at[ind, "temp"])
-        barTempData.loc[barTempData["temp"] == startTemp, "numCases"] = barTempData.loc[barTempData["temp"] == startTemp, "numCases"] + countryData.at[ind, "numCases"]
-        barTempData.loc[barTempData["temp"] == startTemp, "totalPop"] = barTempData.loc[barTempData["temp"] == startTemp, "totalPop"] + countryData.at[ind, "population"]
+    print("Data frame filled.")
 
-    # Calculated density for each temperature range
-    for i in range(-25, 29, 5):
-        barTempData.loc[barTempData["temp"] == i, "density"] = float(barTempData.loc[barTempData["temp"] == i, "numCases"]) / barTempData.loc[barTempData["temp"] == i, "totalPop"]
+# Temperature bins for the bar graph (5 degree ranges, temperatures beyond either end counted in the end ranges)
+# and the scatterplot (each whole degree, temperatures beyond -30 to 30 left out)
+BAR_RESOLUTION = binning.widthResolution(-30, 30, 5, clip = True)
+SCATTER_RESOLUTION = binning.roundedResolution(-30, 30, 1)
 
+# Calculates proportion of COVID-19 cases for each temperature range (barTempData) and each temperature (scatTempData)
+# Both come from one sweep over countryData; bins with no population have no density
+def tempBinAnalysis():
 
-# Given temperature, returns first temperature in the range the given temperature corresponds to
-def findStartTemp(temp):
-    for i in range(-30, 29, 5):
-        if (temp - i >= 0 and temp - (i + 5) < 0):
-            return i
-    return 30
+    global barTempData
+    global scatTempData
+    views = binning.binViews(countryData["temp"], countryData["numCases"], countryData["population"], {"bar" : BAR_RESOLUTION, "scatter" : SCATTER_RESOLUTION})
+    barTempData = views["bar"]
+    scatTempData = views["scatter"]
 
 # Plots barTempData using plotly express
 def plotBarTempData():
+    import plotly.express as px
     print("Plotting temperature data...")
     fig = px.bar(barTempData, x = "temp", y = "density", labels = { "temp" : "Average March temperature (in degrees Celcius)", "density" : "Proportion of population diagnosed with coronavirus"})
-    fig.write_html("COVID-19_graphs.html")
+    report.addFigure(fig, "Proportion diagnosed by average March temperature (5 degree ranges)")
     print("Graph generated.")
 
-# Calculates proportion of individuals diagnosed with COVID-19 for each temperature
-def scatTempAnalysis():
-
-    # scatTempData stores total number of confirmed cases in a range of temperature
-    global scatTempData
-    scatTempData = pd.DataFrame(columns = ["temp", "numCases", "totalPop", "density"])
-    for i in range(-30, 31):
-        scatTempData = scatTempData.append({'temp' : i, 'numCases' : 0, 'totalPop' : 0, 'density' : 0}, ignore_index=True)
-
-    # Iterates through each country, adding numCases and population to the correct temperature
-    for ind in countryData.index:
-        startTemp = round(countryData.at[ind, "temp"])
-        scatTempData.loc[scatTempData["temp"] == startTemp, "numCases"] = scatTempData.loc[scatTempData["temp"] == startTemp, "numCases"] + countryData.at[ind, "numCases"]
-        scatTempData.loc[scatTempData["temp"] == startTemp, "totalPop"] = scatTempData.loc[scatTempData["temp"] == startTemp, "totalPop"] + countryData.at[ind, "population"]
-
-    # Calculating density
-    for i in range(-22, 29):
-        # Avoiding division by zero (population of zero for certain temperatures)
-        if (i == -22 or i == -19 or i == -13 or (i >= -10 and i != -4)):
-            scatTempData.loc[scatTempData["temp"] == i, "density"] = float(scatTempData.loc[scatTempData["temp"] == i, "numCases"]) / scatTempData.loc[scatTempData["temp"] == i, "totalPop"]
-
 # Plots scatTempData using plotly express
 def plotScatTempData():
+    import plotly.express as px
     print("Plotting temperature data...")
     fig = px.scatter(scatTempData, x = "temp", y = "density", labels = { "temp" : "Average March temperature (in degrees Celcius)", "density" : "Proportion of population diagnosed with coronavirus"})
-    fig.write_html("COVID-19_graphs.html")
+    report.addFigure(fig, "Proportion diagnosed by average March temperature")
     print("Graph generated.")
 
+# Saves countryData and the raw cases to today's snapshot in the columnar store
+def saveSnapshot():
+    store.writeSnapshot({"countryData_temperature" : countryData, "cases" : cases})
+
+# Loads countryData and the raw cases from a stored snapshot (memory-mapped) instead of pulling them from the web
+def loadSnapshot(date):
+    print("Loading snapshot " + str(date) + "...")
+    global cases
+    global countries
+    global countryData
+    cases = store.openSnapshot("cases", date)
+    countryData = store.openSnapshot("countryData_temperature", date)
+    countries = set(countryData["country"])
+    print("Snapshot loaded.")
+
 def main():
 
-    pullCovidData()
-    createDataFrame()
-    fillDataFrame()
-    scatTempAnalysis()
-    plotScatTempData()
-    # barTempAnalysis()
+    # Stages run through the shared pipeline, which skips any whose inputs have not changed since the last run
+    options = fetch.parseArgs()
+    pipeline.runTargets(["temperature"], options)
     # plotBarTempData()
 
 if __name__ == '__main__':
@@ -1,13 +1,17 @@
 # Script for generating a scatterplot with x-axis corresponding to GDP per capita and y-axis corresponding to proportion of population diagnosed with coronavirus.
 # Created by Claire Murphy, 3/30/20
 
-import pandas as pd
 import numpy as np
-from urllib.request import urlretrieve
-import requests
-import plotly.express as px
-import country_converter as coco
-import json
+import io
+import COVID19_fetch as fetch
+import COVID19_checkpoint as checkpoint
+import COVID19_worldbank as wb
+import COVID19_aggregate as agg
+import COVID19_ingest as ingest
+import COVID19_store as store
+import COVID19_report as report
+import COVID19_pipeline as pipeline
+import COVID19_countries as countryIds
 
 # Pulls an updated list of COVID-19 cases from a JHU CSSE repo
 def pullCovidData():
@@ -15,35 +19,21 @@ def pullCovidData():
     print("Pulling COVID-19 data from the web...")
     global cases
     cases_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
-    urlretrieve(cases_URL, 'cases.csv')
-    cases = pd.read_csv('cases.csv')
+    cases = ingest.readCases(io.BytesIO(fetch.fetchURL(cases_URL)))
     print("COVID-19 data retrieved.")
 
 # Created dataframe which will store population size, number of diagnosed COVID-19 cases, proportion of diagnosed COVID-19 cases, GDP, and GDP per capita for each country
 def createDataFrame():
 
     print("Creating dataframe...")
-    # Using a set eliminates duplicate countries in our dataset
+    # Keeping only regions that map to a country (no cruise ships), resolved to ISO3 codes in one batch
     global countries
-    countries = set(cases["Country_Region"])
-
-    # Eliminating countries without a valid ISO3 code or countries that throw an error when we input it into the World Bank API
-    countries.discard("Cruise Ship")
-    countries.discard("Holy See")
-    countries.discard("Kosovo")
-    countries.discard("Diamond Princess")
-    countries.discard("MS Zaandam")
-    countries.discard("Taiwan*")
-    countries.discard("Eritrea")
-    countries.discard("Venezuela")
-    countries.discard("Syria")
+    names = countryIds.countriesWithISO3(cases["Country_Region"])[0]
+    countries = set(names)
 
     # Creating the dataframe
     global countryData
-    countryData = pd.DataFrame(columns = ["country", "population", "numCases", "density", "GPD", "perCapGDP"])
-    for country in countries:
-        if str(country) != "nan":
-            countryData = countryData.append({'country' : country, "population" : 0, "numCases" : 0, "density" : 0, "GPD" : 0, "perCapGDP" : 0}, ignore_index=True)
+    countryData = agg.countryTable(names, {"population" : np.float64, "numCases" : np.int64, "density" : np.float64, "GDP" : np.float64, "perCapGDP" : np.float64})
 
     print("Dataframe created.")
 
@@ -54,59 +44,61 @@ def fillDataFrame():
     print("Filling data frame...")
 
     # Adds coronavirus cases to each country
-    for ind in cases.index:
-        country = cases.at[ind, 'Country_Region']
-        # Making sure our "country" is one of the countries we can actually get data on...
-        if country != "Holy See" and country != "Cruise Ship" and country != "Kosovo" and country != "Diamond Princess" and str(country) != "nan":
-            countryData.loc[countryData["country"] == country, "numCases"] = cases.at[ind, "Confirmed"] + countryData.loc[countryData["country"] == country, "numCases"]
-
-    # Adds population size and GDP to each country
-    for ind in countryData.index:
-        country = countryData.at[ind, "country"]
-        if country == "US":
-            ISO = "usa"
-        else:
-            ISO = coco.convert(names = [country], to = 'ISO3')
-
-        # Adding population
-        pop_url = "http://api.worldbank.org/v2/country/" + ISO.lower() + "/indicator/SP.POP.TOTL?date=2016&format=json"
-        pop_response = requests.get(pop_url)
-        pop_json = json.loads(pop_response.text)
-        pop = pop_json[1][0]["value"]
-        countryData.at[ind, "population"] = pop
-
-        # Calculating proportion of population diagnosed with COVID-19
-        countryData.at[ind, "density"] = float(countryData.at[ind, "numCases"]) / pop
-
-        # Adding GDP
-        GDP_url = "http://api.worldbank.org/v2/country/" + ISO.lower() + "/indicator/NY.GDP.MKTP.CD?date=2016&format=json"
-        GDP_response = requests.get(GDP_url)
-        GDP_json = json.loads(GDP_response.text)
-        GDP = GDP_json[1][0]['value']
-        countryData.at[ind, "GDP"] = GDP
-
-        # Calculating GDP per capita
-        countryData.at[ind, "perCapGDP"] = float(GDP) / pop
-
-        # Updating user on status (this part of the code takes a while...)
-        print(country, (35 - len(country)) * (" "), " (", str(ind + 1), "/", str(len(countryData.index)), ')')
+    agg.joinCases(countryData, agg.aggregateCases(cases, countryData["country"]))
+
+    # Looking up each country's ISO3 code
+    ISOs = [countryIds.lookupISO3(country) for country in countryData["country"]]
+
+    # Retrieving population size and GDP for every country in a few bulk requests
+    indicators = wb.pullIndicators([wb.POPULATION, wb.GDP], date = 2016)
+    values = indicators.reindex([ISO.upper() for ISO in ISOs])
+    countryData["population"] = values[wb.POPULATION].to_numpy()
+    countryData["GDP"] = values[wb.GDP].to_numpy()
+
+    # Dropping countries the World Bank has no population or GDP for, and reporting them
+    missing = countryData["population"].isna() | countryData["GDP"].isna()
+    errors = {country : "No World Bank population or GDP for 2016" for country in countryData.loc[missing, "country"]}
+    checkpoint.writeErrorReport(checkpoint.errorReportPath("analysis3_fill"), errors)
+    if missing.any():
+        print("No World Bank data for:", ", ".join(sorted(errors)))
+        countryData.drop(countryData.index[missing], inplace = True)
+        countryData.reset_index(drop = True, inplace = True)
+
+    # Calculating proportion of population diagnosed with COVID-19 and GDP per capita
+    countryData["density"] = countryData["numCases"].astype(float) / countryData["population"]
+    countryData["perCapGDP"] = countryData["GDP"] / countryData["population"]
 
     print("Data frame filled.")
 
 # Plots countryData using plotly express
 def plotCountryData():
+    import plotly.express as px
     print("Plotting per capita GDP data...")
     labelsDict = { "perCapGDP" : "Per capita GDP (in US dollars)", "density" : "Proportion of population diagnosed with coronavirus"}
     fig = px.scatter(countryData, x = "perCapGDP", y = "density", hover_name = "country", labels = labelsDict)
-    fig.write_html("COVID-19_graphs.html")
+    report.addFigure(fig, "Proportion diagnosed by GDP per capita")
     print("Graph generated.")
 
+# Saves countryData and the raw cases to today's snapshot in the columnar store
+def saveSnapshot():
+    store.writeSnapshot({"countryData_gdp" : countryData, "cases" : cases})
+
+# Loads countryData and the raw cases from a stored snapshot (memory-mapped) instead of pulling them from the web
+def loadSnapshot(date):
+    print("Loading snapshot " + str(date) + "...")
+    global cases
+    global countries
+    global countryData
+    cases = store.openSnapshot("cases", date)
+    countryData = store.openSnapshot("countryData_gdp", date)
+    countries = set(countryData["country"])
+    print("Snapshot loaded.")
+
 def main():
 
-    pullCovidData()
-    createDataFrame()
-    fillDataFrame()
-    plotCountryData()
+    # Stages run through the shared pipeline, which skips any whose inputs have not changed since the last run
+    options = fetch.parseArgs()
+    pipeline.runTargets(["gdp"], options)
 
 if __name__ == '__main__':
     main()
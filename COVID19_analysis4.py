@@ -2,14 +2,18 @@
 # Added feature: Calculates LSRL for our two variables.
 # Created by Claire Murphy, 3/30/20
 
-import pandas as pd
 import numpy as np
-from urllib.request import urlretrieve
-import requests
-import plotly.express as px
-import plotly.graph_objects as go
-import country_converter as coco
-import json
+import io
+import COVID19_fetch as fetch
+import COVID19_checkpoint as checkpoint
+import COVID19_worldbank as wb
+import COVID19_aggregate as agg
+import COVID19_ingest as ingest
+import COVID19_store as store
+import COVID19_report as report
+import COVID19_pipeline as pipeline
+import COVID19_countries as countryIds
+import COVID19_regression as regression
 
 # Pulls an updated list of COVID-19 cases from a JHU CSSE repo
 def pullCovidData():
@@ -17,37 +21,21 @@ def pullCovidData():
     print("Pulling COVID-19 data from the web...")
     global cases
     cases_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
-    urlretrieve(cases_URL, 'cases.csv')
-    cases = pd.read_csv('cases.csv')
+    cases = ingest.readCases(io.BytesIO(fetch.fetchURL(cases_URL)))
     print("COVID-19 data retrieved.")
 
 # Created dataframe which will store population size, number of diagnosed COVID-19 cases, proportion of diagnosed COVID-19 cases, GDP, and GDP per capita for each country
 def createDataFrame():
 
     print("Creating dataframe...")
-    # Using a set eliminates duplicate countries in our dataset
+    # Keeping only regions that map to a country (no cruise ships), resolved to ISO3 codes in one batch
     global countries
-    countries = set(cases["Country_Region"])
-
-    # Eliminating countries without a valid ISO3 code or countries that throw an error when we input it into the World Bank API
-    countries.discard("Cruise Ship")
-    countries.discard("Holy See")
-    countries.discard("Kosovo")
-    countries.discard("Diamond Princess")
-    countries.discard("MS Zaandam")
-    countries.discard("Taiwan*")
-    countries.discard("Eritrea")
-    countries.discard("Venezuela")
-    countries.discard("Syria")
-    for country in countries:
-        if str(country) == "nan":
-            countries.discard(country)
+    names = countryIds.countriesWithISO3(cases["Country_Region"])[0]
+    countries = set(names)
 
     # Creating the dataframe
     global countryData
-    countryData = pd.DataFrame(columns = ["country", "population", "numCases", "density", "GPD", "perCapGDP"])
-    for country in countries:
-        countryData = countryData.append({'country' : country, "population" : 0, "numCases" : 0, "density" : 0, "GPD" : 0, "perCapGDP" : 0}, ignore_index=True)
+    countryData = agg.countryTable(names, {"population" : np.float64, "numCases" : np.int64, "density" : np.float64, "GDP" : np.float64, "perCapGDP" : np.float64})
 
     print("Dataframe created.")
 
@@ -58,77 +46,61 @@ def fillDataFrame():
     print("Filling data frame...")
 
     # Adds coronavirus cases to each country
-    for ind in cases.index:
-        country = cases.at[ind, 'Country_Region']
-        # Making sure our "country" is one of the countries we can actually get data on...
-        if country in countries:
-            countryData.loc[countryData["country"] == country, "numCases"] = cases.at[ind, "Confirmed"] + countryData.loc[countryData["country"] == country, "numCases"]
-
-    # Adds population size and GDP to each country
-    for ind in countryData.index:
-        country = countryData.at[ind, "country"]
-        if country == "US":
-            ISO = "usa"
-        else:
-            ISO = coco.convert(names = [country], to = 'ISO3')
-
-        # Adding population
-        pop_url = "http://api.worldbank.org/v2/country/" + ISO.lower() + "/indicator/SP.POP.TOTL?date=2016&format=json"
-        pop_response = requests.get(pop_url)
-        pop_json = json.loads(pop_response.text)
-        pop = pop_json[1][0]["value"]
-        countryData.at[ind, "population"] = pop
-
-        # Calculating proportion of population diagnosed with COVID-19
-        countryData.at[ind, "density"] = float(countryData.at[ind, "numCases"]) / pop
-
-        # Addding GDP
-        GDP_url = "http://api.worldbank.org/v2/country/" + ISO.lower() + "/indicator/NY.GDP.MKTP.CD?date=2016&format=json"
-        GDP_response = requests.get(GDP_url)
-        GDP_json = json.loads(GDP_response.text)
-        GDP = GDP_json[1][0]['value']
-        countryData.at[ind, "GDP"] = GDP
-
-        # Calculating GDP per capita
-        countryData.at[ind, "perCapGDP"] = float(GDP) / pop
-
-        # Updating user on status (this part of the code takes a while...)
-        print(country, (35 - len(country)) * (" "), " (", str(ind + 1), "/", str(len(countryData.index)), ')')
+    agg.joinCases(countryData, agg.aggregateCases(cases, countryData["country"]))
+
+    # Looking up each country's ISO3 code
+    ISOs = [countryIds.lookupISO3(country) for country in countryData["country"]]
+
+    # Retrieving population size and GDP for every country in a few bulk requests
+    indicators = wb.pullIndicators([wb.POPULATION, wb.GDP], date = 2016)
+    values = indicators.reindex([ISO.upper() for ISO in ISOs])
+    countryData["population"] = values[wb.POPULATION].to_numpy()
+    countryData["GDP"] = values[wb.GDP].to_numpy()
+
+    # Dropping countries the World Bank has no population or GDP for, and reporting them
+    missing = countryData["population"].isna() | countryData["GDP"].isna()
+    errors = {country : "No World Bank population or GDP for 2016" for country in countryData.loc[missing, "country"]}
+    checkpoint.writeErrorReport(checkpoint.errorReportPath("analysis4_fill"), errors)
+    if missing.any():
+        print("No World Bank data for:", ", ".join(sorted(errors)))
+        countryData.drop(countryData.index[missing], inplace = True)
+        countryData.reset_index(drop = True, inplace = True)
+
+    # Calculating proportion of population diagnosed with COVID-19 and GDP per capita
+    countryData["density"] = countryData["numCases"].astype(float) / countryData["population"]
+    countryData["perCapGDP"] = countryData["GDP"] / countryData["population"]
 
     print("Data frame filled.")
 
 # Calculates LSRL for our data
+# B holds the intercept (B[0, 0]) and slope (B[1, 0]), solved by QR decomposition rather than inverting XᵀX
 def LSRLAnalysis():
 
-    # A matrix of only ones
-    ones = []
-    for i in range(0, len(countries)):
-        ones.append([1])
+    global B
+    fit = regression.fitIndicators(countryData[["perCapGDP"]], countryData["density"]).loc["perCapGDP"]
+    B = np.array([[fit["intercept"]], [fit["slope"]]])
 
-    # A matrix with GDP per capita for each country
-    perCapGDP_t = [countryData.iloc[:, 5].values]
-    perCapGDP_t_arr = np.asarray(perCapGDP_t)
-    perCapGDP_arr = perCapGDP_t_arr.transpose()
+    print("Least Squares Regression Line: Proportion of population diagnosed with COVID-19 = " + str(B[1, 0]) + "(GDP per capita) + " + str(B[0, 0]))
+    print("Slope standard error: " + str(fit["slopeSE"]) + ", R squared: " + str(fit["r2"]))
 
-    # Matrix with x-values (GDP per capita)
-    X = np.concatenate((np.asarray(ones), perCapGDP_arr), axis = 1)
-    X_t = X.transpose()
+# Confidence level of the band drawn around the LSRL, and the points along GDP per capita it is computed at
+BAND_LEVEL = 0.95
+BAND_POINTS = 100
 
-    Y_t = np.asarray([countryData.iloc[:, 3].values])
-    Y = Y_t.transpose()
+# Bootstraps the LSRL to get a confidence band around it (band) over the range of GDP per capita in countryData
+# All the resamples are fitted at once; workers spreads them over that many processes
+def bootstrapAnalysis(numResamples = 10000, workers = None):
 
-    # Calculating our LSRL
-    B_0 = X_t.dot(X)
-    B_0_inversable=np.matrix(B_0, dtype='float')
-    B_1 = np.linalg.inv(B_0_inversable)
-    B_2 = X_t.dot(Y)
-    global B
-    B = B_1.dot(B_2)
+    print("Bootstrapping LSRL...")
+    global band
+    fits = regression.bootstrapFits(countryData["perCapGDP"], countryData["density"], numResamples = numResamples, workers = workers)
+    xs = np.linspace(countryData["perCapGDP"].min(), countryData["perCapGDP"].max(), BAND_POINTS)
+    band = regression.confidenceBand(fits, xs, BAND_LEVEL)
+    print("Bootstrap complete.")
 
-    print("Least Squares Regression Line: Proportion of population diagnosed with COVID-19 = " + str(B[1, 0]) + "(GDP per capita) + " + str(B[0, 0]))
-
-# Plots countryData using plotly express
+# Plots countryData using plotly graph objects
 def plotCountryData():
+    import plotly.graph_objects as go
 
     print("Plotting per capita GDP data...")
 
@@ -136,19 +108,10 @@ def plotCountryData():
     fig = go.Figure()
     fig.add_trace(go.Scatter(x = countryData["perCapGDP"], y = countryData["density"], hovertext = countryData["country"], hoverinfo = "text", mode = 'markers', name = 'Individual points'))
 
-    # Dataframe storing two points with which to plot our LSRL
-    ourLine = pd.DataFrame(columns = ["x_values", "y_values"])
-    ourLine.set_index("x_values")
-
-    minPerCapGDP = float(countryData.loc[countryData['country'] == 'Somalia', 'perCapGDP'])
-    ourLine.at[minPerCapGDP, "x_values"] = minPerCapGDP
-    ourLine.at[minPerCapGDP, "y_values"] = (minPerCapGDP * B[1, 0]) + B[0, 0]
-
-    maxPerCapGDP = float(countryData.loc[countryData['country'] == 'Monaco', 'perCapGDP'])
-    ourLine.at[maxPerCapGDP, "x_values"] = maxPerCapGDP
-    ourLine.at[maxPerCapGDP, "y_values"] = (maxPerCapGDP * B[1, 0]) + B[0, 0]
-
-    fig.add_trace(go.Scatter(x = ourLine["x_values"], y = ourLine["y_values"], mode = 'lines+markers', name = 'LSRL'))
+    # Plotting our LSRL across the range of GDP per capita in the data, with its bootstrapped confidence band
+    fig.add_trace(go.Scatter(x = band["x"], y = band["upper"], mode = 'lines', line = dict(width = 0), showlegend = False, hoverinfo = "skip"))
+    fig.add_trace(go.Scatter(x = band["x"], y = band["lower"], mode = 'lines', line = dict(width = 0), fill = 'tonexty', name = str(int(BAND_LEVEL * 100)) + '% confidence band'))
+    fig.add_trace(go.Scatter(x = band["x"], y = (band["x"] * B[1, 0]) + B[0, 0], mode = 'lines', name = 'LSRL'))
 
     # Adding labels to our axes
     fig.update_layout(
@@ -157,16 +120,31 @@ def plotCountryData():
         yaxis_title="Proportion of Individuals Diagnosed with COVID-19",
     )
 
-    fig.show()
+    report.addFigure(fig)
     print("Graph generated.")
 
+# Saves countryData and the raw cases to today's snapshot in the columnar store
+def saveSnapshot():
+    store.writeSnapshot({"countryData_gdp" : countryData, "cases" : cases})
+
+# Loads countryData and the raw cases from a stored snapshot (memory-mapped) instead of pulling them from the web
+def loadSnapshot(date):
+    print("Loading snapshot " + str(date) + "...")
+    global cases
+    global countries
+    global countryData
+    cases = store.openSnapshot("cases", date)
+    countryData = store.openSnapshot("countryData_gdp", date)
+    countries = set(countryData["country"])
+    print("Snapshot loaded.")
+
 def main():
 
-    pullCovidData()
-    createDataFrame()
-    fillDataFrame()
-    LSRLAnalysis()
-    plotCountryData()
+    # Stages run through the shared pipeline, which skips any whose inputs have not changed since the last run
+    options = fetch.parseArgs()
+    pipeline.runTargets(["gdp-lsrl"], options)
+    # Showing the graph when there is a display to show it on
+    report.openReport()
 
 if __name__ == '__main__':
     main()
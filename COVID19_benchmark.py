@@ -0,0 +1,243 @@
+# Benchmarks for the shared COVID19 stages and for every stage of the four analyses.
+# Everything runs against synthetic cases files and the local mock server, never the real APIs, and results can be
+# written as JSON so runs of different versions can be compared.
+# Usage: python COVID19_benchmark.py [--quick] [--rows 200 100000] [--latency 0.02] [--error-rate 0.01] [--output COVID-19_benchmark.json]
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import COVID19_aggregate as agg
+import COVID19_analysis2 as analysis2
+import COVID19_countries as countryIds
+import COVID19_fetch as fetch
+import COVID19_mockServer as mockServer
+import COVID19_pipeline as pipeline
+
+# Fetches a URL without the disk cache, so every timed request reaches the server (and nothing is cached from the mock)
+def fetchUncached(url):
+    return fetch.fetchURL(url, useCache = False)
+
+# Times fetching one climate CSV and one population record per country at increasing concurrency
+def benchFetch(numCountries = 180, latency = 0.05, workerCounts = (1, 2, 4, 8, 16, 32)):
+
+    print("Benchmarking concurrent fetch (" + str(numCountries) + " countries, " + str(int(latency * 1000)) + " ms latency)...")
+    server, base = mockServer.startServer(latency = latency)
+    isos = ["C" + str(i).zfill(2) for i in range(numCountries)]
+    urls = []
+    for iso in isos:
+        urls.append(base + "/climateweb/rest/v1/country/mavg/tas/2020/2039/" + iso.lower() + ".CSV")
+        urls.append(base + "/rest/v2/alpha/" + iso.lower())
+
+    results = []
+    fetch.getSession(max(workerCounts))
+    try:
+        for workers in workerCounts:
+            start = time.perf_counter()
+            fetch.mapConcurrent(fetchUncached, urls, workers)
+            elapsed = time.perf_counter() - start
+            results.append({"workers" : workers, "requests" : len(urls), "seconds" : elapsed})
+            print("  workers =", str(workers).rjust(3), "  ", format(elapsed, ".2f"), "s")
+    finally:
+        server.shutdown()
+    return results
+
+# Times building a country table row by row (the old DataFrame.append pattern) against building it column by column
+# The row-by-row build is quadratic, so it is only timed up to appendLimit rows
+def benchTableBuild(sizes = (10000, 100000), appendLimit = 10000):
+
+    print("Benchmarking table construction...")
+    columns = {"population" : np.float64, "numCases" : np.int64, "density" : np.float64, "GDP" : np.float64, "perCapGDP" : np.float64}
+    results = []
+    for size in sizes:
+        names = ["country" + str(i) for i in range(size)]
+
+        start = time.perf_counter()
+        agg.countryTable(names, columns)
+        columnar = time.perf_counter() - start
+
+        rowByRow = None
+        if size <= appendLimit:
+            start = time.perf_counter()
+            table = pd.DataFrame(columns = ["country"] + list(columns))
+            for name in names:
+                row = {"country" : name}
+                row.update({column : 0 for column in columns})
+                table = pd.concat([table, pd.DataFrame([row])], ignore_index = True)
+            rowByRow = time.perf_counter() - start
+
+        # Binning stages of analysis2 over the same number of synthetic countries
+        rng = np.random.default_rng(0)
+        analysis2.countryData = agg.countryTable(names, {"temp" : np.float64, "population" : np.int64, "numCases" : np.int64})
+        analysis2.countryData["temp"] = rng.uniform(-30, 30, size)
+        analysis2.countryData["population"] = rng.integers(1000, 10000000, size)
+        analysis2.countryData["numCases"] = rng.integers(0, 1000, size)
+        start = time.perf_counter()
+        analysis2.tempBinAnalysis()
+        binning = time.perf_counter() - start
+
+        results.append({"rows" : size, "columnarSeconds" : columnar, "rowByRowSeconds" : rowByRow, "binningSeconds" : binning})
+        print("  rows =", str(size).rjust(7), "  columnar", format(columnar, ".4f"), "s", "  row by row", "skipped" if rowByRow is None else format(rowByRow, ".2f") + " s", "  binning stages", format(binning, ".4f"), "s")
+    return results
+
+# Countries used for synthetic cases files (names as the JHU feed spells them)
+SYNTHETIC_COUNTRIES = ["US", "France", "Chad", "Peru", "India", "Brazil", "Japan", "Kenya", "Norway", "Australia",
+                       "Germany", "Italy", "Spain", "China", "Mexico", "Canada", "Argentina", "Egypt", "Nigeria", "South Africa",
+                       "Russia", "Turkey", "Iran", "Pakistan", "Bangladesh", "Indonesia", "Vietnam", "Thailand", "Philippines", "Malaysia",
+                       "Chile", "Colombia", "Ecuador", "Bolivia", "Morocco", "Algeria", "Ethiopia", "Ghana", "Senegal", "Mali",
+                       "Sweden", "Finland", "Poland", "Ukraine", "Greece", "Portugal", "Ireland", "Iceland", "New Zealand", "Mongolia"]
+
+# Rows per chunk when writing large synthetic files, so memory stays flat up to millions of rows
+GENERATE_CHUNK = 500000
+
+# Writes a synthetic cases.csv with the same columns as the JHU web-data feed and returns its path
+# Rows are written in chunks, so files of 200 to 5M+ rows can be made; the same seed always gives the same file
+def generateCases(numRows, path, seed = 0):
+    rng = np.random.default_rng(seed)
+    with open(path, "w", newline = "") as f:
+        for first in range(0, max(numRows, 1), GENERATE_CHUNK):
+            _casesChunk(rng, first, min(GENERATE_CHUNK, numRows - first)).to_csv(f, index = False, header = first == 0)
+    return path
+
+def _casesChunk(rng, first, numRows):
+    country = rng.choice(SYNTHETIC_COUNTRIES, numRows)
+    rowNumber = first + np.arange(numRows)
+    confirmed = rng.integers(0, 50000, numRows)
+    deaths = (confirmed * rng.uniform(0, 0.05, numRows)).astype(np.int64)
+    recovered = (confirmed * rng.uniform(0, 0.5, numRows)).astype(np.int64)
+    cases = pd.DataFrame({
+        "Country_Region" : country,
+        "Province_State" : np.char.add(country.astype(str), (rowNumber % 50).astype(str)),
+        "Admin2" : np.char.add("County", (rowNumber % 997).astype(str)),
+        "Last_Update" : "2020-06-01 00:00:00",
+        "Lat" : rng.uniform(-60, 70, numRows).round(5),
+        "Long_" : rng.uniform(-180, 180, numRows).round(5),
+        "Confirmed" : confirmed,
+        "Deaths" : deaths,
+        "Recovered" : recovered,
+        "Active" : confirmed - deaths - recovered,
+        "FIPS" : rowNumber + 1000,
+        "Incident_Rate" : rng.uniform(0, 5000, numRows).round(3),
+        "People_Tested" : confirmed * 10,
+        "People_Hospitalized" : (confirmed * 0.1).astype(np.int64),
+        "Mortality_Rate" : rng.uniform(0, 10, numRows).round(3),
+        "UID" : rowNumber + 84000000,
+        "ISO3" : "XXX",
+    })
+    return cases
+
+# Code run in a fresh interpreter for each ingestion variant, so each gets its own memory high-water mark
+_INGEST_VARIANTS = {
+    "read_csv" : "import pandas as pd, COVID19_aggregate as agg; agg.aggregateCases(pd.read_csv(PATH))",
+    "readCases" : "import COVID19_ingest as ingest, COVID19_aggregate as agg; agg.aggregateCases(ingest.readCases(PATH))",
+    "chunked" : "import COVID19_ingest as ingest; ingest.aggregateCasesChunked(PATH)",
+}
+
+# Times aggregating a large synthetic cases file with plain pd.read_csv, with readCases, and chunked, reporting peak memory of each
+def benchIngest(sizes = (100000, 1000000)):
+
+    print("Benchmarking cases ingestion...")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = generateCases(size, os.path.join(directory, "cases.csv"))
+            for name, code in _INGEST_VARIANTS.items():
+                # VmHWM is the process's resident memory high-water mark (Linux only)
+                script = ("import time; PATH = " + repr(path) + "; start = time.perf_counter(); " + code +
+                          "; print(time.perf_counter() - start, [line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0])")
+                output = subprocess.run([sys.executable, "-c", script], capture_output = True, text = True, check = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.split()
+                seconds, peakKB = float(output[-2]), int(output[-1])
+                results.append({"rows" : size, "variant" : name, "seconds" : seconds, "peakMB" : peakKB / 1024})
+                print("  rows =", str(size).rjust(8), " ", name.ljust(10), format(seconds, ".2f"), "s  peak", format(peakKB / 1024, ".0f"), "MB")
+    return results
+
+# Every target of the pipeline, which between them run every stage of the four analyses
+STAGE_TARGETS = ["temperature-cases", "latitude", "temperature", "gdp", "gdp-lsrl"]
+
+# Times every stage of the four analyses on synthetic cases files of each size, served with the mock APIs
+# Each size is run cold (empty cache and memo, so every request goes to the mock server) and then warm (cached responses)
+# Runs in a scratch directory, so the cache, snapshots and report of a real run are not touched
+def benchStages(sizes = (200, 100000), latency = 0.02, errorRate = 0.0):
+
+    print("Benchmarking analysis stages (" + str(int(latency * 1000)) + " ms latency, " + str(errorRate * 100) + "% errors)...")
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        ISOs = countryIds.countriesWithISO3(SYNTHETIC_COUNTRIES)[1]
+        server, base = mockServer.startServer(latency = latency, countries = ISOs, errorRate = errorRate)
+        fetch.setMirror(base)
+        try:
+            for size in sizes:
+                generateCases(size, "cases.csv")
+                with open("cases.csv", "rb") as f:
+                    server.files["/CSSEGISandData/COVID-19/web-data/data/cases.csv"] = f.read()
+                fetch.parseArgs(args = ["--clear-cache"])
+                for run in ("cold", "warm"):
+                    runner = pipeline.createPipeline(persist = False)
+                    start = time.perf_counter()
+                    runner.run(STAGE_TARGETS)
+                    total = time.perf_counter() - start
+                    for timing in runner.timings:
+                        results.append({"rows" : size, "run" : run, **timing})
+                    results.append({"rows" : size, "run" : run, "stage" : "total", "seconds" : total, "cached" : False})
+                    print("  rows =", str(size).rjust(8), " ", run, format(total, ".2f"), "s")
+        finally:
+            os.chdir(cwd)
+            fetch.setMirror(None)
+            server.shutdown()
+    return results
+
+# Versions and machine details recorded with each set of results
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time" : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit" : commit,
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "pandas" : pd.__version__,
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count(),
+    }
+
+def main():
+
+    extra = [
+        ("--quick", {"action" : "store_true", "help" : "small sizes only, for a fast check"}),
+        ("--rows", {"nargs" : "+", "type" : int, "help" : "synthetic cases.csv sizes for the stage benchmark"}),
+        ("--latency", {"type" : float, "default" : 0.02, "help" : "mock API latency, in seconds"}),
+        ("--error-rate", {"type" : float, "default" : 0.0, "dest" : "errorRate", "help" : "share of mock API requests that fail"}),
+        ("--output", {"help" : "write the results to this JSON file"}),
+    ]
+    options = fetch.parseArgs("Benchmark the COVID-19 analysis stages against synthetic data and a mock API server.", extraArguments = extra)
+    if options.quick:
+        results = {
+            "fetch" : benchFetch(numCountries = 20, workerCounts = (1, 16)),
+            "tableBuild" : benchTableBuild(sizes = (1000,), appendLimit = 1000),
+            "ingest" : benchIngest(sizes = (10000,)),
+            "stages" : benchStages(sizes = options.rows or (200,), latency = options.latency, errorRate = options.errorRate),
+        }
+    else:
+        results = {
+            "fetch" : benchFetch(),
+            "tableBuild" : benchTableBuild(),
+            "ingest" : benchIngest(),
+            "stages" : benchStages(sizes = options.rows or (200, 100000, 1000000), latency = options.latency, errorRate = options.errorRate),
+        }
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({"environment" : environment(), "results" : results}, f, indent = 2)
+        print("Results written to " + options.output + ".")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Vectorized binning engine for the COVID19_analysis scripts.
+# Sums a numerator (cases) and a denominator (population) into bins and computes their ratio, masking empty bins.
+
+import numpy as np
+import pandas as pd
+
+# Describes one binning resolution: the bin edges, the label reported for each bin,
+# and whether values outside the edges fold into the first and last bins (otherwise they are left out)
+def resolution(edges, labels = None, clip = False):
+    edges = np.asarray(edges, dtype = np.float64)
+    if labels is None:
+        labels = edges[:-1]
+    return {"edges" : edges, "labels" : np.asarray(labels), "clip" : clip}
+
+# Bins [start, start + width), [start + width, start + 2 * width), ... up to and including the bin starting at stop, labelled by their start
+def widthResolution(start, stop, width, clip = False):
+    numBins = int(round((stop - start) / width)) + 1
+    edges = start + width * np.arange(numBins + 1, dtype = np.float64)
+    return resolution(edges, edges[:-1], clip)
+
+# Bins of the given width centred on start, start + width, ... stop, labelled by their centre (the value each number rounds to)
+def roundedResolution(start, stop, width = 1, clip = False):
+    centres = start + width * np.arange(int(round((stop - start) / width)) + 1, dtype = np.float64)
+    edges = np.append(centres - width / 2, centres[-1] + width / 2)
+    return resolution(edges, centres, clip)
+
+# Returns the bin index of every value (-1 for values left out of every bin)
+def binIndex(values, spec):
+    values = np.asarray(values, dtype = np.float64)
+    numBins = len(spec["edges"]) - 1
+    index = np.digitize(values, spec["edges"]) - 1
+    if spec["clip"]:
+        index = np.clip(index, 0, numBins - 1)
+    else:
+        index[(index < 0) | (index >= numBins)] = -1
+    index[np.isnan(values)] = -1
+    return index
+
+# Sums each weight array into the bins of one resolution with np.bincount
+# weights maps a name to an array the same length as values; returns a dictionary of name -> per-bin sums
+def binSums(values, weights, spec):
+    index = binIndex(values, spec)
+    keep = index >= 0
+    numBins = len(spec["edges"]) - 1
+    return {name : np.bincount(index[keep], weights = np.asarray(w, dtype = np.float64)[keep], minlength = numBins) for name, w in weights.items()}
+
+# numerator / denominator per bin, with NaN wherever the denominator is zero
+def binRatio(numerator, denominator):
+    numerator = np.asarray(numerator, dtype = np.float64)
+    denominator = np.asarray(denominator, dtype = np.float64)
+    ratio = np.full(len(numerator), np.nan)
+    nonEmpty = denominator != 0
+    ratio[nonEmpty] = numerator[nonEmpty] / denominator[nonEmpty]
+    return ratio
+
+# Bins values at several resolutions in one sweep over the data
+# The values are sorted once and the weights prefix-summed; each resolution then only needs a binary search per bin edge
+# views maps a name to a resolution; returns a dictionary of name -> table with columns
+# labelColumn, numeratorColumn, denominatorColumn and ratioColumn
+def binViews(values, numerator, denominator, views, labelColumn = "temp", numeratorColumn = "numCases", denominatorColumn = "totalPop", ratioColumn = "density"):
+    values = np.asarray(values, dtype = np.float64)
+    numerator = np.nan_to_num(np.asarray(numerator, dtype = np.float64))
+    denominator = np.nan_to_num(np.asarray(denominator, dtype = np.float64))
+
+    valid = ~np.isnan(values)
+    order = np.argsort(values[valid], kind = "stable")
+    sortedValues = values[valid][order]
+    numeratorSums = np.concatenate(([0.0], np.cumsum(numerator[valid][order])))
+    denominatorSums = np.concatenate(([0.0], np.cumsum(denominator[valid][order])))
+
+    tables = {}
+    for name, spec in views.items():
+        # cuts[i] is the number of values below edge i, so bin i holds the sorted values cuts[i] to cuts[i + 1]
+        cuts = np.searchsorted(sortedValues, spec["edges"], side = "left")
+        if spec["clip"]:
+            cuts[0] = 0
+            cuts[-1] = len(sortedValues)
+        binNumerator = np.diff(numeratorSums[cuts])
+        binDenominator = np.diff(denominatorSums[cuts])
+        tables[name] = pd.DataFrame({
+            labelColumn : spec["labels"],
+            numeratorColumn : binNumerator,
+            denominatorColumn : binDenominator,
+            ratioColumn : binRatio(binNumerator, binDenominator),
+        })
+    return tables
+
+# Estimated population of each row of the cases table
+# Uses a Population column when there is one, otherwise backs it out of Incident_Rate (cases per 100,000 people); NaN where neither is known
+def rowPopulation(cases):
+    if "Population" in cases.columns:
+        return cases["Population"].to_numpy(dtype = np.float64, na_value = np.nan)
+    if "Incident_Rate" in cases.columns:
+        confirmed = cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan)
+        rate = cases["Incident_Rate"].to_numpy(dtype = np.float64, na_value = np.nan)
+        population = np.full(len(rate), np.nan)
+        known = rate > 0
+        population[known] = confirmed[known] * 100000 / rate[known]
+        return population
+    return np.full(len(cases.index), np.nan)
+
+# Weighted histogram of confirmed cases (and, where known, population and incidence) by distance from the equator
+# Bins are [0, resolution), [resolution, 2 * resolution), ... up to the bin holding 90 degrees, labelled by their start
+def latitudeHistogram(cases, resolution = 1.0):
+    lat = cases["Lat"].to_numpy(dtype = np.float64, na_value = np.nan)
+    confirmed = np.nan_to_num(cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan))
+    population = rowPopulation(cases)
+    spec = widthResolution(0, np.floor(90 / resolution) * resolution, resolution)
+    sums = binSums(np.abs(lat), {"numCases" : confirmed, "population" : np.nan_to_num(population)}, spec)
+    return pd.DataFrame({
+        "distance" : np.round(spec["labels"], 6),
+        "numCases" : sums["numCases"],
+        "population" : sums["population"],
+        "incidence" : binRatio(sums["numCases"], sums["population"]),
+    })
+
+# 2-D latitude x longitude grid of confirmed cases, population and incidence, for heatmaps
+# Returns a dictionary with the cell edges ("latEdges", "longEdges") and one (lat cells x long cells) array per quantity
+def latLongGrid(cases, resolution = 1.0):
+    lat = cases["Lat"].to_numpy(dtype = np.float64, na_value = np.nan)
+    lon = cases["Long_"].to_numpy(dtype = np.float64, na_value = np.nan)
+    confirmed = np.nan_to_num(cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan))
+    population = np.nan_to_num(rowPopulation(cases))
+
+    numLat = int(np.ceil(180 / resolution))
+    numLong = int(np.ceil(360 / resolution))
+    valid = ~np.isnan(lat) & ~np.isnan(lon)
+    row = np.clip(((lat[valid] + 90) // resolution).astype(np.int64), 0, numLat - 1)
+    column = np.clip(((lon[valid] + 180) // resolution).astype(np.int64), 0, numLong - 1)
+    cell = row * numLong + column
+
+    numCases = np.bincount(cell, weights = confirmed[valid], minlength = numLat * numLong).reshape(numLat, numLong)
+    totalPop = np.bincount(cell, weights = population[valid], minlength = numLat * numLong).reshape(numLat, numLong)
+    return {
+        "latEdges" : -90 + resolution * np.arange(numLat + 1),
+        "longEdges" : -180 + resolution * np.arange(numLong + 1),
+        "numCases" : numCases,
+        "population" : totalPop,
+        "incidence" : binRatio(numCases.ravel(), totalPop.ravel()).reshape(numLat, numLong),
+    }
@@ -0,0 +1,179 @@
+# Persistent on-disk cache for responses from the external data sources.
+# Entries are stored under a hash of their URL, expire after a per-source TTL, and the cache is kept under a size limit.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = os.environ.get("COVID19_CACHE_DIR", ".covid19_cache")
+
+# Total size the cache may grow to before the least recently used entries are evicted
+MAX_BYTES = 512 * 1024 * 1024
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Time to live for each source, matched against the URL; None means the entry never expires
+# Climate projections and past World Bank years do not change, the JHU cases feed changes several times a day
+# The path patterns also match the same sources served by COVID19_mockServer
+TTLS = [
+    ("climatedataapi.worldbank.org", None),
+    ("/climateweb/", None),
+    ("api.worldbank.org", 4 * WEEK),
+    ("/v2/country/", 4 * WEEK),
+    ("restcountries", 4 * WEEK),
+    ("/rest/v2/", 4 * WEEK),
+    ("raw.githubusercontent.com", HOUR),
+]
+DEFAULT_TTL = DAY
+
+# In offline mode every request must be answered from the cache, however old the entry is
+offline = False
+
+_lock = threading.Lock()
+_totalBytes = None
+
+# Raised in offline mode when a URL has never been cached
+class OfflineCacheMiss(Exception):
+    pass
+
+# Turns offline mode on or off
+def setOffline(value = True):
+    global offline
+    offline = value
+
+# Returns the TTL in seconds for a URL, or None if it never expires
+def ttlFor(url):
+    for pattern, ttl in TTLS:
+        if pattern in url:
+            return ttl
+    return DEFAULT_TTL
+
+# Key under which a URL is stored
+def cacheKey(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+def _paths(url):
+    key = cacheKey(url)
+    return os.path.join(CACHE_DIR, key + ".body"), os.path.join(CACHE_DIR, key + ".json")
+
+# Returns the metadata stored for a URL, or None if it is not cached
+def getMeta(url):
+    bodyPath, metaPath = _paths(url)
+    try:
+        with open(metaPath) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Whether a cache entry is still within its TTL
+def isFresh(meta):
+    ttl = ttlFor(meta["url"])
+    return ttl is None or time.time() - meta["fetched"] < ttl
+
+# Returns the cached body for a URL, or None if it is missing (or expired, unless allowStale)
+def get(url, allowStale = False):
+    meta = getMeta(url)
+    if meta is None or not (allowStale or isFresh(meta)):
+        return None
+    bodyPath, metaPath = _paths(url)
+    try:
+        with open(bodyPath, "rb") as f:
+            content = f.read()
+    except OSError:
+        return None
+    # Touching the body marks the entry as recently used for eviction
+    try:
+        os.utime(bodyPath)
+    except OSError:
+        pass
+    return content
+
+# Stores a response body and any extra metadata (such as validators) for a URL
+def put(url, content, **extra):
+    global _totalBytes
+    os.makedirs(CACHE_DIR, exist_ok = True)
+    bodyPath, metaPath = _paths(url)
+    meta = {"url" : url, "fetched" : time.time(), "size" : len(content)}
+    meta.update(extra)
+
+    # Writing to a temporary file first keeps concurrent readers from seeing a half-written entry
+    suffix = "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    with open(bodyPath + suffix, "wb") as f:
+        f.write(content)
+    os.replace(bodyPath + suffix, bodyPath)
+    with open(metaPath + suffix, "w") as f:
+        json.dump(meta, f)
+    os.replace(metaPath + suffix, metaPath)
+
+    with _lock:
+        if _totalBytes is None:
+            _totalBytes = cacheSize()
+        else:
+            _totalBytes = _totalBytes + len(content)
+        if _totalBytes > MAX_BYTES:
+            _totalBytes = evict(MAX_BYTES)
+
+# Marks an existing entry as freshly fetched without rewriting its body (after the server says it has not changed)
+def touch(url, **extra):
+    meta = getMeta(url)
+    if meta is None:
+        return
+    bodyPath, metaPath = _paths(url)
+    meta["fetched"] = time.time()
+    meta.update(extra)
+    suffix = "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    with open(metaPath + suffix, "w") as f:
+        json.dump(meta, f)
+    os.replace(metaPath + suffix, metaPath)
+
+# Total size in bytes of every cached body
+def cacheSize():
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    total = 0
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".body"):
+            total = total + entry.stat().st_size
+    return total
+
+# Removes the least recently used entries until the cache fits in maxBytes, and returns the new size
+def evict(maxBytes = None):
+    if maxBytes is None:
+        maxBytes = MAX_BYTES
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    bodies = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".body"):
+            stat = entry.stat()
+            bodies.append((stat.st_mtime, stat.st_size, entry.path))
+    bodies.sort()
+    total = sum(size for mtime, size, path in bodies)
+    for mtime, size, path in bodies:
+        if total <= maxBytes:
+            break
+        for victim in (path, path[:-len(".body")] + ".json"):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total = total - size
+    return total
+
+# Whether a file in the cache directory belongs to a cache entry (a body or its metadata, named by cacheKey)
+# Other modules keep their own files here too, such as the ISO3 name table, which must survive a clear
+def _isEntryFile(name):
+    key, extension = os.path.splitext(name)
+    return extension in (".body", ".json") and len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+# Deletes every cached entry
+def clear():
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for entry in os.scandir(CACHE_DIR):
+        if _isEntryFile(entry.name):
+            os.remove(entry.path)
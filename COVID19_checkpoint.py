@@ -0,0 +1,115 @@
+# Checkpointing for the per-country fill stages of the COVID19_analysis scripts.
+# Each country's result is appended to a checkpoint file as soon as it is ready, so a rerun only repeats the countries that are missing.
+# Countries that fail are collected into an error report instead of aborting the run.
+
+import json
+import os
+import threading
+import COVID19_cache as cache
+import COVID19_fetch as fetch
+
+# Whether fill stages keep the results checkpointed by an earlier run (set by --resume)
+resume = False
+
+_lock = threading.Lock()
+
+# Failures reported by writeErrorReport since the process started, so callers can tell whether a stage had any
+failureCount = 0
+
+# Turns resume mode on or off
+def setResume(value = True):
+    global resume
+    resume = value
+
+# Where the checkpoint for a fill stage is kept
+def checkpointPath(name):
+    return os.path.join(cache.CACHE_DIR, name + ".checkpoint.jsonl")
+
+# Where the error report for a fill stage is written
+def errorReportPath(name):
+    return "COVID-19_" + name + "_errors.json"
+
+# Returns the results recorded in a checkpoint file as a dictionary of key -> record
+def loadCheckpoint(path):
+    records = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                records[entry["key"]] = entry["record"]
+    except OSError:
+        pass
+    return records
+
+# Appends one result to a checkpoint file
+def recordCheckpoint(path, key, record):
+    line = json.dumps({"key" : key, "record" : record}, default = _toJSON)
+    with _lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+        with open(path, "a") as f:
+            f.write(line + "\n")
+
+# Deletes a checkpoint file
+def clearCheckpoint(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Writes the per-country failures of a run to a JSON report, or removes an old report if nothing failed
+def writeErrorReport(path, errors):
+    global failureCount
+    failureCount = failureCount + len(errors)
+    if len(errors) == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w") as f:
+        json.dump({key : str(error) for key, error in sorted(errors.items())}, f, indent = 2)
+
+# NumPy scalars are not JSON serializable on their own
+def _toJSON(value):
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("Cannot checkpoint " + repr(value))
+
+# Runs func(key) for every key concurrently, checkpointing each result as it completes
+# In resume mode, keys already in the checkpoint are not run again
+# Returns (results, errors): dictionaries of key -> record for the keys that succeeded and key -> exception for those that failed
+def runCheckpointed(name, keys, func, workers = None):
+    if workers is None:
+        workers = fetch.DEFAULT_WORKERS
+    path = checkpointPath(name)
+    if resume:
+        done = loadCheckpoint(path)
+    else:
+        clearCheckpoint(path)
+        done = {}
+
+    keys = list(keys)
+    todo = [key for key in keys if key not in done]
+    if len(done) > 0:
+        print("Resuming:", str(len(keys) - len(todo)), "of", str(len(keys)), "already done.")
+
+    def runOne(key):
+        record = func(key)
+        recordCheckpoint(path, key, record)
+        return record
+
+    outcomes = fetch.mapConcurrent(runOne, todo, workers, returnExceptions = True, progress = fetch.printProgress(len(todo)))
+    results = {key : done[key] for key in keys if key in done}
+    errors = {}
+    for key, outcome in zip(todo, outcomes):
+        if isinstance(outcome, Exception):
+            errors[key] = outcome
+        else:
+            results[key] = outcome
+
+    writeErrorReport(errorReportPath(name), errors)
+    if len(errors) > 0:
+        print(str(len(errors)), "failed (see " + errorReportPath(name) + "); rerun with --resume to retry only those.")
+    return results, errors
@@ -0,0 +1,104 @@
+# Projected monthly temperatures from the World Bank's Climate Data API, held in memory as one table.
+# Each country's CSV (one row per climate model, one column per month) is parsed straight from the response bytes into a
+# dense countries x months x periods array indexed by ISO3 code, pulled once for every country. Temperatures for any
+# month, season or period are then array lookups, with no further requests or parsing.
+
+import numpy as np
+import COVID19_fetch as fetch
+
+CLIMATE_URL = "http://climatedataapi.worldbank.org/climateweb/rest/v1/country/mavg/tas/"
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Meteorological seasons (northern hemisphere names), usable wherever a month is
+SEASONS = {
+    "DJF" : ["Dec", "Jan", "Feb"],
+    "MAM" : ["Mar", "Apr", "May"],
+    "JJA" : ["Jun", "Jul", "Aug"],
+    "SON" : ["Sep", "Oct", "Nov"],
+}
+
+# The 20-year projection periods the API serves, and the one the analyses use
+PERIODS = [(2020, 2039), (2040, 2059), (2060, 2079), (2080, 2099)]
+DEFAULT_PERIOD = (2020, 2039)
+
+# Row of each CSV the analyses take their projection from (the scripts have always used the second model)
+MODEL_ROW = 1
+
+# URL of one country's monthly projections for one period
+def climateURL(ISO, period = None):
+    fromYear, toYear = period or DEFAULT_PERIOD
+    return CLIMATE_URL + str(fromYear) + "/" + str(toYear) + "/" + ISO.lower() + ".CSV"
+
+def _number(value):
+    return float(value) if value.strip() else np.nan
+
+# Parses a climate CSV into a (models x 12) array of monthly temperatures, in the order of MONTHS
+# Raises ValueError for a response that is not a climate CSV
+def parseClimateCSV(content):
+    lines = content.decode("utf-8").strip().splitlines()
+    if len(lines) == 0:
+        raise ValueError("Empty climate response")
+    header = [column.strip() for column in lines[0].split(",")]
+    columns = [header.index(month) for month in MONTHS]
+    rows = [line.split(",") for line in lines[1:] if line.strip()]
+    return np.array([[_number(row[column]) for column in columns] for row in rows], dtype = np.float64).reshape(len(rows), len(MONTHS))
+
+# Pulls the projections of every country for the given periods (default: DEFAULT_PERIOD) into one table
+# Returns (table, errors): table is a dictionary of the ISO3 codes ("ISO3"), their rows ("index"), "periods", and "temps",
+# a (countries x 12 months x periods) array with NaN wherever no projection could be had; errors maps ISO3 code -> exception
+def pullClimateTable(ISOs, periods = None, workers = None):
+    periods = [tuple(period) for period in periods or [DEFAULT_PERIOD]]
+    ISOs = list(dict.fromkeys(ISO.upper() for ISO in ISOs))
+    print("Pulling climate projections for " + str(len(ISOs)) + " countries...")
+    urls = [climateURL(ISO, period) for ISO in ISOs for period in periods]
+    contents = fetch.fetchAll(urls, workers or fetch.DEFAULT_WORKERS, returnExceptions = True)
+
+    temps = np.full((len(ISOs), len(MONTHS), len(periods)), np.nan)
+    errors = {}
+    for position, content in enumerate(contents):
+        row, period = divmod(position, len(periods))
+        if isinstance(content, Exception):
+            errors[ISOs[row]] = content
+            continue
+        try:
+            models = parseClimateCSV(content)
+        except (ValueError, IndexError, UnicodeDecodeError) as error:
+            errors[ISOs[row]] = ValueError("Unreadable climate CSV: " + str(error))
+            continue
+        if len(models) <= MODEL_ROW:
+            errors[ISOs[row]] = ValueError("No projection in model row " + str(MODEL_ROW))
+            continue
+        temps[row, :, period] = models[MODEL_ROW]
+    print("Climate projections retrieved.")
+
+    table = {
+        "ISO3" : ISOs,
+        "index" : {ISO : row for row, ISO in enumerate(ISOs)},
+        "periods" : periods,
+        "temps" : temps,
+    }
+    return table, errors
+
+# Columns of MONTHS making up a month ("Mar"), a season ("JJA") or a list of months
+def monthColumns(month):
+    months = SEASONS.get(month, month) if isinstance(month, str) else month
+    if isinstance(months, str):
+        months = [months]
+    return [MONTHS.index(name) for name in months]
+
+# Rows of the table for ISO3 codes, -1 for codes it does not hold
+def tableRows(table, ISOs):
+    return np.array([table["index"].get(ISO.upper(), -1) for ISO in ISOs], dtype = np.int64)
+
+# Every month's temperature for the given ISO3 codes in one period, as a (len(ISOs) x 12) array (NaN where unknown)
+def monthlyTemps(table, ISOs, period = None):
+    rows = tableRows(table, ISOs)
+    if len(table["ISO3"]) == 0:
+        return np.full((len(rows), len(MONTHS)), np.nan)
+    monthly = table["temps"][:, :, table["periods"].index(tuple(period or DEFAULT_PERIOD))]
+    return np.where((rows >= 0)[:, None], monthly[rows], np.nan)
+
+# Temperature of a month, or the mean over a season or list of months, for the given ISO3 codes (NaN where unknown)
+def monthTemps(table, ISOs, month = "Mar", period = None):
+    return monthlyTemps(table, ISOs, period)[:, monthColumns(month)].mean(axis = 1)
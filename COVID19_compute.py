@@ -0,0 +1,117 @@
+# Compute-only entry point for scheduled jobs: runs the stages behind the analyses' tables and writes the tables as CSV or
+# JSON, without plotting or snapshotting anything.
+# plotly is only imported by the plot functions, requests when the first request is actually sent, and country_converter
+# when a country name is missing from the persisted ISO3 table, so a run served from the cache and the memo loads none of
+# them. Pass --import-times to see what each of them would cost a fresh interpreter, and which this run loaded.
+# Usage: python COVID19_compute.py temperature latitude gdp-lsrl [--format json] [--output-dir DIR] [--import-times]
+
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+import COVID19_fetch as fetch
+import COVID19_metrics as metrics
+import COVID19_pipeline as pipeline
+
+OUTPUT_DIR = "covid19_tables"
+
+# The file each table is written to (without extension), by the artifact holding it
+TABLES = {
+    "temps.agTempData" : "agTempData",
+    "latitude.latData" : "latData",
+    "latitude.latLongData" : "latLongData",
+    "temperature.countryData" : "temperatureCountryData",
+    "temperature.barTempData" : "barTempData",
+    "temperature.scatTempData" : "scatTempData",
+    "gdp.countryData" : "gdpCountryData",
+    "gdp.B" : "gdpLSRL",
+    "gdp.band" : "gdpBand",
+}
+
+# Dependencies slow enough to import that compute-only runs avoid them
+HEAVY_MODULES = ["plotly.express", "plotly.graph_objects", "requests", "country_converter"]
+
+# The latitude x longitude grid as one row per occupied cell, by the centre of the cell
+def _latLongTable(grid):
+    latCentres = (grid["latEdges"][:-1] + grid["latEdges"][1:]) / 2
+    longCentres = (grid["longEdges"][:-1] + grid["longEdges"][1:]) / 2
+    row, column = np.nonzero((grid["numCases"] > 0) | (grid["population"] > 0))
+    return pd.DataFrame({
+        "lat" : latCentres[row],
+        "long" : longCentres[column],
+        "numCases" : grid["numCases"][row, column],
+        "population" : grid["population"][row, column],
+        "incidence" : grid["incidence"][row, column],
+    })
+
+def _table(artifact, value):
+    if artifact == "latitude.latLongData":
+        return _latLongTable(value)
+    if artifact == "gdp.B":
+        return pd.DataFrame({"intercept" : [value[0, 0]], "slope" : [value[1, 0]]})
+    return value
+
+# Writes every table among the artifacts to directory as CSV or JSON (a list of records), and returns the paths written
+def writeTables(artifacts, directory = None, fileFormat = "csv"):
+    directory = directory or OUTPUT_DIR
+    os.makedirs(directory, exist_ok = True)
+    paths = []
+    for artifact, name in TABLES.items():
+        if artifact not in artifacts:
+            continue
+        table = _table(artifact, artifacts[artifact])
+        path = os.path.join(directory, name + "." + fileFormat)
+        if fileFormat == "json":
+            table.to_json(path, orient = "records", indent = 1)
+        else:
+            table.to_csv(path, index = False)
+        paths.append(path)
+    return paths
+
+# Seconds each module takes to import into a fresh interpreter that already has numpy and pandas loaded (as every run does)
+# Each is measured in its own interpreter, so modules they share are not credited to whichever happens to go first
+# A module that fails to import gets None
+def importTimes(modules = None):
+    times = {}
+    for module in modules or HEAVY_MODULES:
+        code = "import time, numpy, pandas\nstart = time.perf_counter()\nimport " + module + "\nprint(time.perf_counter() - start)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True)
+        times[module] = float(result.stdout.strip().splitlines()[-1]) if result.returncode == 0 else None
+    return times
+
+# Whether this process has imported each module
+def loadedModules(modules = None):
+    return {module : module in sys.modules for module in modules or HEAVY_MODULES}
+
+def main():
+
+    extra = [
+        ("targets", {"nargs" : "+", "help" : "analyses to compute: temperature-cases, latitude, latlong, temperature, gdp, gdp-lsrl"}),
+        ("--param", {"action" : "append", "metavar" : "NAME=VALUE", "help" : "override a stage parameter, e.g. latResolution=0.5"}),
+        ("--format", {"choices" : ["csv", "json"], "default" : "csv", "dest" : "fileFormat", "help" : "table file format"}),
+        ("--output-dir", {"dest" : "outputDir", "default" : OUTPUT_DIR, "help" : "where to write the tables"}),
+        ("--import-times", {"action" : "store_true", "dest" : "importTimes", "help" : "measure the import time of each heavy dependency"}),
+    ]
+    options = fetch.parseArgs("Compute the COVID-19 analysis tables without plotting them.", extraArguments = extra)
+    start = time.perf_counter()
+    if options.clear_cache:
+        pipeline.clearMemo()
+    runner = pipeline.createPipeline(pipeline.parseParams(options.param), options.snapshot, date = options.date, window = options.window)
+    paths = writeTables(runner.compute(options.targets), options.outputDir, options.fileFormat)
+    summary = {"tables" : paths, "seconds" : time.perf_counter() - start, "loaded" : loadedModules()}
+    print(str(len(paths)) + " tables written to " + options.outputDir + ".")
+
+    if options.importTimes:
+        summary["importTimes"] = importTimes()
+        for module, seconds in summary["importTimes"].items():
+            status = "loaded" if summary["loaded"][module] else "not loaded"
+            print("  " + module.ljust(24), "not installed" if seconds is None else format(seconds, ".3f") + " s", "(" + status + ")")
+    with open(os.path.join(options.outputDir, "run.json"), "w") as f:
+        json.dump(summary, f, indent = 2)
+    metrics.writeOutputs(options)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Country identity layer: resolves the JHU Country_Region names to ISO3 codes.
+# Names are resolved in one batch through country_converter, persisted to disk, and then looked up from an in-memory table.
+
+import contextlib
+import io
+import json
+import logging
+import os
+import COVID19_cache as cache
+
+# Where the name -> ISO3 table is persisted between runs
+TABLE_PATH = os.path.join(cache.CACHE_DIR, "iso3_names.json")
+
+# Names country_converter gets wrong or cannot resolve. None marks regions with no country (cruise ships and the like)
+OVERRIDES = {
+    "US" : "USA",
+    "Kosovo" : "XKX",
+    "Taiwan*" : "TWN",
+    "Holy See" : "VAT",
+    "Cruise Ship" : None,
+    "Diamond Princess" : None,
+    "MS Zaandam" : None,
+    "Summer Olympics 2020" : None,
+    "Winter Olympics 2022" : None,
+}
+
+_NOT_FOUND = "not found"
+
+# In-memory name -> ISO3 table, loaded from TABLE_PATH on first use
+_table = None
+
+def _loadTable():
+    global _table
+    if _table is None:
+        try:
+            with open(TABLE_PATH) as f:
+                _table = json.load(f)
+        except (OSError, ValueError):
+            _table = {}
+        _table.update(OVERRIDES)
+    return _table
+
+def _saveTable():
+    os.makedirs(os.path.dirname(TABLE_PATH) or ".", exist_ok = True)
+    with open(TABLE_PATH + ".tmp", "w") as f:
+        json.dump(_table, f, indent = 0, sort_keys = True)
+    os.replace(TABLE_PATH + ".tmp", TABLE_PATH)
+
+# Resolves every name in names, converting the ones not seen before in a single country_converter call
+# Returns a dictionary of name -> ISO3 code (None for names with no country)
+def resolveISO3(names):
+    table = _loadTable()
+    names = [name for name in dict.fromkeys(names) if isinstance(name, str)]
+    unknown = [name for name in names if name not in table]
+    if len(unknown) > 0:
+        # country_converter is slow to import and chatty, so it is only loaded (and silenced) when there is something new
+        import country_converter as coco
+        logging.getLogger("country_converter").setLevel(logging.ERROR)
+        with contextlib.redirect_stdout(io.StringIO()):
+            codes = coco.convert(names = unknown, to = 'ISO3', not_found = _NOT_FOUND)
+        if isinstance(codes, str):
+            codes = [codes]
+        for name, code in zip(unknown, codes):
+            table[name] = code if code != _NOT_FOUND else None
+        _saveTable()
+    return {name : table[name] for name in names}
+
+# Returns the ISO3 code for a name that has already been resolved, or None
+def lookupISO3(name):
+    return _loadTable().get(name)
+
+# Returns the names in names that map to a real country, sorted, and their ISO3 codes
+def countriesWithISO3(names):
+    resolved = resolveISO3(names)
+    valid = sorted(name for name, code in resolved.items() if code is not None)
+    return valid, [resolved[name] for name in valid]
@@ -0,0 +1,166 @@
+# Shared fetch layer used by the COVID19_analysis scripts.
+# Runs HTTP requests concurrently on a bounded thread pool over one pooled requests session.
+# requests is only imported when the first request is sent, so runs served entirely from the cache never load it.
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import COVID19_cache as cache
+import COVID19_checkpoint as checkpoint
+import COVID19_metrics as metrics
+
+# Default number of requests allowed in flight at once
+DEFAULT_WORKERS = 16
+
+_session = None
+_sessionLock = threading.Lock()
+
+# Hosts of the external data sources; with a mirror set, requests to any of them go to the mirror instead (same paths)
+MIRRORED_HOSTS = ["https://raw.githubusercontent.com", "http://climatedataapi.worldbank.org", "https://restcountries.eu", "http://api.worldbank.org"]
+mirror = None
+
+# Sends every request for the external data sources to another server, such as COVID19_mockServer (None to stop)
+def setMirror(base):
+    global mirror
+    mirror = base
+
+def _mirrored(url):
+    if mirror is None:
+        return url
+    for host in MIRRORED_HOSTS:
+        if url.startswith(host + "/"):
+            return mirror + url[len(host):]
+    return url
+
+# Sends a GET over the shared session, recording its host, status, size and latency in the run metrics
+def _get(url, headers = None, timeout = 60):
+    import requests
+    start = time.perf_counter()
+    try:
+        response = getSession().get(url, headers = headers, timeout = timeout)
+    except requests.RequestException:
+        metrics.recordRequest(url, None, 0, start, time.perf_counter() - start)
+        raise
+    metrics.recordRequest(url, response.status_code, len(response.content), start, time.perf_counter() - start)
+    return response
+
+# Returns the process-wide session, creating it with a connection pool large enough for our workers
+def getSession(workers = DEFAULT_WORKERS):
+    global _session
+    with _sessionLock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = workers, pool_maxsize = workers)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+# Returns the response body for a URL as bytes, from the on-disk cache when possible
+# An expired entry is revalidated with a conditional request, so an unchanged source costs a 304 instead of a full download
+# In offline mode only the cache is consulted, and a URL that was never cached raises OfflineCacheMiss
+def fetchURL(url, timeout = 60, useCache = True):
+    url = _mirrored(url)
+    if not useCache:
+        response = _get(url, timeout = timeout)
+        response.raise_for_status()
+        return response.content
+    content = cache.get(url, allowStale = cache.offline)
+    if content is not None:
+        metrics.recordCache(url, "hit")
+        return content
+    return fetchConditional(url, timeout)[0]
+
+# Returns (content, changed) for a URL, asking the server whether the cached copy is still current even if it has not expired
+# The cached copy's ETag and Last-Modified are sent as If-None-Match / If-Modified-Since; changed is False when the server
+# answers 304 Not Modified or sends back exactly what was cached
+def fetchConditional(url, timeout = 60):
+    url = _mirrored(url)
+    meta = cache.getMeta(url)
+    cached = cache.get(url, allowStale = True) if meta is not None else None
+    if cache.offline:
+        if cached is None:
+            raise cache.OfflineCacheMiss("Not in the cache (offline mode): " + url)
+        metrics.recordCache(url, "offline")
+        return cached, False
+
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("lastModified"):
+            headers["If-Modified-Since"] = meta["lastModified"]
+
+    response = _get(url, headers = headers, timeout = timeout)
+    if response.status_code == 304 and cached is not None:
+        cache.touch(url)
+        metrics.recordCache(url, "notModified")
+        return cached, False
+    response.raise_for_status()
+    metrics.recordCache(url, "miss")
+    cache.put(url, response.content, etag = response.headers.get("ETag"), lastModified = response.headers.get("Last-Modified"))
+    return response.content, response.content != cached
+
+# Calls func on every item using up to "workers" threads and returns the results in the same order as items
+# With returnExceptions, a failed call yields its exception instead of aborting the whole batch
+def mapConcurrent(func, items, workers = DEFAULT_WORKERS, returnExceptions = False, progress = None):
+    items = list(items)
+
+    def callOne(item):
+        try:
+            result = func(item)
+        except Exception as error:
+            if not returnExceptions:
+                raise
+            result = error
+        if progress is not None:
+            progress(item)
+        return result
+
+    if workers <= 1:
+        return [callOne(item) for item in items]
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(callOne, items))
+
+# Downloads every URL in urls using up to "workers" concurrent requests
+# Results come back in the same order as urls, whatever order the requests finish in
+# With returnExceptions, a failed request yields its exception instead of aborting the whole batch
+def fetchAll(urls, workers = DEFAULT_WORKERS, returnExceptions = False, progress = None):
+    getSession(workers)
+    return mapConcurrent(fetchURL, urls, workers, returnExceptions, progress)
+
+# Returns a progress callback that prints "(done / total)" as each item completes
+def printProgress(total):
+    lock = threading.Lock()
+    done = [0]
+
+    def callback(item):
+        with lock:
+            done[0] = done[0] + 1
+            print("(", str(done[0]), "/", str(total), ")", item)
+    return callback
+
+# Parses the command line options shared by every analysis script
+# extraArguments lists (flag, keyword arguments) pairs for options only one script needs
+def parseArgs(description = None, args = None, extraArguments = None):
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--offline", action = "store_true", help = "serve every request from the local cache and never touch the network")
+    parser.add_argument("--clear-cache", action = "store_true", help = "empty the local response cache before running")
+    parser.add_argument("--resume", action = "store_true", help = "keep the per-country results checkpointed by an earlier run and only fill in what is missing")
+    parser.add_argument("--snapshot", metavar = "DATE", help = "load the tables saved by an earlier run (a date such as 2020-04-01, or \"latest\") instead of pulling data from the web")
+    parser.add_argument("--date", help = "run on the JHU daily time series as of this date (such as 2020-04-01) instead of the latest cases.csv")
+    parser.add_argument("--window", type = int, metavar = "DAYS", help = "run on the JHU daily time series, counting only the cases confirmed in the DAYS days up to --date")
+    parser.add_argument("--metrics", metavar = "PATH", help = "write per-stage timings, memory, HTTP and cache metrics for the run to this JSON file")
+    parser.add_argument("--trace", metavar = "PATH", help = "write the run's stages and requests as a Chrome trace (chrome://tracing, Perfetto) to this file")
+    parser.add_argument("--profile", action = "append", metavar = "STAGE", help = "run a stage under cProfile, writing " + metrics.PROFILE_DIR + "/STAGE.prof (repeatable; \"all\" for every stage)")
+    for flag, kwargs in extraArguments or []:
+        parser.add_argument(flag, **kwargs)
+    options = parser.parse_args(args)
+    if options.clear_cache:
+        cache.clear()
+    cache.setOffline(options.offline)
+    checkpoint.setResume(options.resume)
+    metrics.configure(options)
+    return options
@@ -0,0 +1,74 @@
+# Memory-lean ingestion of the JHU cases.csv feed.
+# Only the columns the analyses use are read, with compact numeric dtypes and categorical region names.
+# Large files can be streamed in chunks into a running aggregate, so peak memory stays flat as the input grows.
+
+import numpy as np
+import pandas as pd
+import COVID19_aggregate as agg
+import COVID19_binning as binning
+
+# Columns the analyses use and the dtype each is read as (columns missing from a file are simply skipped)
+CASES_DTYPES = {
+    "Country_Region" : "category",
+    "Province_State" : "category",
+    "Admin2" : "category",
+    "Lat" : "float32",
+    "Long_" : "float32",
+    "Confirmed" : "float64",
+    "Deaths" : "float64",
+    "Recovered" : "float64",
+    "Active" : "float64",
+    "Incident_Rate" : "float32",
+    "UID" : "float64",
+    "FIPS" : "float64",
+}
+
+# Columns stored as nullable integers once read. The parser is several times slower at producing these directly,
+# so they are parsed as floats and converted afterwards. Counts are 32-bit; sums over them are taken in 64 bits
+INTEGER_DTYPES = {
+    "Confirmed" : "Int32",
+    "Deaths" : "Int32",
+    "Recovered" : "Int32",
+    "Active" : "Int32",
+    "UID" : "Int64",
+}
+
+# Rows per chunk when streaming
+CHUNK_SIZE = 250000
+
+def _usecols(columns):
+    wanted = set(columns)
+    return lambda column: column in wanted
+
+def _readOptions(columns):
+    return {"usecols" : _usecols(columns), "dtype" : {column : CASES_DTYPES[column] for column in columns if column in CASES_DTYPES}}
+
+# Converts the count columns of a freshly read table to their compact integer dtypes
+def _compact(cases):
+    for column, dtype in INTEGER_DTYPES.items():
+        if column in cases.columns:
+            cases[column] = cases[column].astype(dtype)
+    return cases
+
+# Reads a cases file (a path or a file-like object) keeping only the given columns, with compact dtypes
+def readCases(source, columns = None):
+    if columns is None:
+        columns = list(CASES_DTYPES)
+    return _compact(pd.read_csv(source, **_readOptions(columns)))
+
+# Streams a cases file in chunks, keeping a running per-country total of the case columns and a per-degree latitude total
+# Only one chunk is in memory at a time. Returns a dictionary with "country" (as aggregateCases) and "latitude" (as latitudeHistogram)
+def aggregateCasesChunked(source, chunksize = CHUNK_SIZE, resolution = 1.0):
+    columns = ["Country_Region", "Lat", "Confirmed", "Deaths", "Recovered", "Active"]
+    countryTotals = None
+    latitudeTotals = None
+    for chunk in pd.read_csv(source, chunksize = chunksize, **_readOptions(columns)):
+        totals = agg.aggregateCases(chunk).astype(np.int64)
+        histogram = binning.latitudeHistogram(chunk, resolution).set_index("distance")[["numCases"]]
+        if countryTotals is None:
+            countryTotals = totals
+            latitudeTotals = histogram
+        else:
+            countryTotals = countryTotals.add(totals, fill_value = 0)
+            latitudeTotals = latitudeTotals + histogram
+    return {"country" : countryTotals.astype(np.int64), "latitude" : latitudeTotals}
@@ -0,0 +1,216 @@
+# Run instrumentation shared by the pipeline, the fetch layer and the scripts.
+# Records, for each stage, its wall time, CPU time, peak memory and the HTTP traffic it caused; for each external host, its
+# request count, bytes transferred and latency percentiles; and how many responses came from the local cache. The result is
+# written as a JSON report, or as a trace (Chrome trace event format, for chrome://tracing or Perfetto) showing stages and
+# requests on a timeline. Stages can also be run under cProfile, one .prof file each.
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Where cProfile output for profiled stages is written
+PROFILE_DIR = "covid19_profiles"
+
+# Latency percentiles reported for each host
+PERCENTILES = [50, 90, 99]
+
+# Stages run under cProfile (stage names, or "all")
+profiledStages = set()
+
+# Whether peak memory is tracked per stage (tracemalloc slows allocation-heavy code, so it is off unless asked for)
+trackMemory = False
+
+_lock = threading.Lock()
+_origin = time.perf_counter()
+stages = []
+httpRequests = []
+cacheCounts = {}
+
+# Starts recording a new run
+def reset():
+    global _origin
+    with _lock:
+        _origin = time.perf_counter()
+        stages.clear()
+        httpRequests.clear()
+        cacheCounts.clear()
+
+# Turns per-stage memory tracking on or off
+def setTrackMemory(value = True):
+    global trackMemory
+    trackMemory = value
+    if value and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not value and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+# Chooses the stages to run under cProfile
+def setProfiled(stageNames):
+    profiledStages.clear()
+    profiledStages.update(stageNames or [])
+
+def _host(url):
+    return urlsplit(url).netloc
+
+# Records one HTTP request: its URL, status (None if it failed before a response), body size and how long it took
+def recordRequest(url, status, numBytes, start, seconds):
+    with _lock:
+        httpRequests.append({
+            "host" : _host(url),
+            "url" : url,
+            "status" : status,
+            "bytes" : numBytes,
+            "start" : start - _origin,
+            "seconds" : seconds,
+            "thread" : threading.get_ident(),
+        })
+
+# Records how a URL was served by the local cache: "hit" (fresh entry), "miss" (downloaded), "notModified" (revalidated
+# with a 304) or "offline" (stale entry served in offline mode)
+def recordCache(url, outcome):
+    with _lock:
+        counts = cacheCounts.setdefault(_host(url), {"hit" : 0, "miss" : 0, "notModified" : 0, "offline" : 0})
+        counts[outcome] = counts[outcome] + 1
+
+def _requestTotals():
+    with _lock:
+        return len(httpRequests), sum(request["bytes"] for request in httpRequests), sum(request["seconds"] for request in httpRequests)
+
+def _maxRSS():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Restarts peak tracking. Python 3.8 has no reset_peak; clearing the traces there restarts the peak from zero, at the
+# cost of no longer seeing the blocks allocated before the stage (so ones it frees are not subtracted)
+def _resetPeak():
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.clear_traces()
+
+# Measures one stage. Use as "with metrics.measureStage(name) as record:"; the record is filled in when the block ends
+# and is also kept for the report: wall and CPU seconds, peak traced memory (with trackMemory), the process's peak resident
+# memory so far, and the requests made while it ran (their latencies summed, so concurrent requests can exceed the wall time)
+# A block that sets record["kept"] = False is left out of the report (such as a memo lookup that found nothing)
+@contextlib.contextmanager
+def measureStage(name, cached = False):
+    record = {"stage" : name, "cached" : cached}
+    profiler = None
+    if name in profiledStages or "all" in profiledStages:
+        profiler = cProfile.Profile()
+    if trackMemory:
+        _resetPeak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    numRequests, numBytes, requestSeconds = _requestTotals()
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        end = time.perf_counter()
+        record["start"] = start - _origin
+        record["seconds"] = end - start
+        record["cpuSeconds"] = time.process_time() - cpuStart
+        if trackMemory:
+            record["peakBytes"] = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        record["maxRSS"] = _maxRSS()
+        afterRequests, afterBytes, afterSeconds = _requestTotals()
+        record["requests"] = afterRequests - numRequests
+        record["bytes"] = afterBytes - numBytes
+        record["requestSeconds"] = afterSeconds - requestSeconds
+        if profiler is not None:
+            os.makedirs(PROFILE_DIR, exist_ok = True)
+            record["profile"] = os.path.join(PROFILE_DIR, name + ".prof")
+            profiler.dump_stats(record["profile"])
+        if record.pop("kept", True):
+            with _lock:
+                stages.append(record)
+
+# Request count, errors, bytes and latency percentiles (in seconds) for each host
+def hostSummary():
+    with _lock:
+        byHost = {}
+        for request in httpRequests:
+            byHost.setdefault(request["host"], []).append(request)
+    summary = {}
+    for host, hostRequests in sorted(byHost.items()):
+        latencies = np.array([request["seconds"] for request in hostRequests])
+        summary[host] = {
+            "requests" : len(hostRequests),
+            "errors" : sum(1 for request in hostRequests if request["status"] is None or request["status"] >= 400),
+            "bytes" : sum(request["bytes"] for request in hostRequests),
+            "latency" : {"p" + str(p) : float(np.percentile(latencies, p)) for p in PERCENTILES},
+            "maxLatency" : float(latencies.max()),
+        }
+    return summary
+
+# Everything recorded since the last reset, as a JSON-ready dictionary
+def runReport():
+    with _lock:
+        stageRecords = list(stages)
+        cache = {host : dict(counts) for host, counts in cacheCounts.items()}
+    return {
+        "stages" : stageRecords,
+        "hosts" : hostSummary(),
+        "cache" : cache,
+        "memo" : {
+            "hits" : sum(1 for record in stageRecords if record["cached"]),
+            "misses" : sum(1 for record in stageRecords if not record["cached"]),
+        },
+        "totals" : {
+            "seconds" : sum(record["seconds"] for record in stageRecords),
+            "cpuSeconds" : sum(record["cpuSeconds"] for record in stageRecords),
+            "maxRSS" : _maxRSS(),
+        },
+    }
+
+# Writes the run report as JSON
+def writeReport(path):
+    with open(path, "w") as f:
+        json.dump(runReport(), f, indent = 2)
+    print("Run metrics written to " + path + ".")
+
+# Writes stages and requests as a Chrome trace: stages on track 0, each request on the track of the thread that made it
+def writeTrace(path):
+    events = [{"name" : "process_name", "ph" : "M", "pid" : os.getpid(), "args" : {"name" : "COVID-19 analysis"}}]
+    with _lock:
+        for record in stages:
+            events.append({"name" : record["stage"], "cat" : "stage", "ph" : "X", "pid" : os.getpid(), "tid" : 0,
+                "ts" : record["start"] * 1e6, "dur" : record["seconds"] * 1e6,
+                "args" : {key : value for key, value in record.items() if key not in ("stage", "start", "seconds")}})
+        for request in httpRequests:
+            events.append({"name" : request["host"], "cat" : "http", "ph" : "X", "pid" : os.getpid(), "tid" : request["thread"],
+                "ts" : request["start"] * 1e6, "dur" : request["seconds"] * 1e6,
+                "args" : {"url" : request["url"], "status" : request["status"], "bytes" : request["bytes"]}})
+    with open(path, "w") as f:
+        json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, f)
+    print("Run trace written to " + path + ".")
+
+# Applies the instrumentation options parsed by COVID19_fetch.parseArgs
+def configure(options):
+    setTrackMemory(bool(options.metrics or options.trace))
+    setProfiled(options.profile)
+
+# Writes whichever outputs the options ask for
+def writeOutputs(options):
+    if options.metrics:
+        writeReport(options.metrics)
+    if options.trace:
+        writeTrace(options.trace)
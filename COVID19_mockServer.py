@@ -0,0 +1,141 @@
+# Local stand-in for the external APIs used by the COVID19_analysis scripts.
+# Serves climate CSVs, REST Countries population JSON and World Bank indicator JSON with an artificial latency,
+# failing a given share of those requests, plus any static files (such as a synthetic cases.csv) it is given.
+
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Country codes served for "all" requests unless startServer is given its own list
+DEFAULT_COUNTRIES = ["C" + str(i).zfill(3) for i in range(200)]
+
+# Deterministic pseudo-random number in [0, 1) derived from a string, so every run serves the same data
+def _unit(key):
+    return (zlib.crc32(key.encode()) % 100000) / 100000.0
+
+# Builds a World Bank climate API style CSV for one country
+def climateCSV(iso, fromYear = "2020", toYear = "2039"):
+    lines = ["GCM,var,from_year,to_year," + ",".join(MONTHS)]
+    base = -20 + 50 * _unit(iso)
+    for gcm in range(3):
+        temps = [round(base + 10 * _unit(iso + str(gcm) + month) - 5, 3) for month in MONTHS]
+        lines.append("model_" + str(gcm) + ",tas," + fromYear + "," + toYear + "," + ",".join(str(t) for t in temps))
+    return "\n".join(lines) + "\n"
+
+# Population for one country, as served by the REST Countries mock
+def population(iso):
+    return int(100000 + 200000000 * _unit(iso + "pop") ** 3)
+
+# Value of a World Bank indicator for one country
+def indicatorValue(iso, indicator):
+    if indicator == "SP.POP.TOTL":
+        return population(iso)
+    return population(iso) * (500 + 80000 * _unit(iso + indicator) ** 2)
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive lets clients reuse pooled connections, as they would against the real APIs
+    protocol_version = "HTTP/1.1"
+
+    # Buffering the response sends headers and body in one write instead of two small packets
+    wbufsize = 65536
+
+    # Class-level settings, overwritten by startServer
+    latency = 0.0
+    errorRate = 0.0
+    countries = DEFAULT_COUNTRIES
+    files = {}
+    rng = random.Random(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        if url.path in self.files:
+            self.sendFile(self.files[url.path])
+            return
+        parts = [p for p in url.path.split("/") if p]
+        if self.errorRate > 0 and self.rng.random() < self.errorRate:
+            self.send_error(503)
+            return
+        try:
+            body, contentType = self.route(parts, parse_qs(url.query))
+        except (IndexError, KeyError):
+            self.send_error(404)
+            return
+        payload = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Serves a static file, honouring If-None-Match so clients can revalidate their cached copy
+    def sendFile(self, payload):
+        etag = '"' + str(zlib.crc32(payload)) + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Maps a request path onto a generated response
+    def route(self, parts, query):
+        if parts[0] == "climateweb":
+            iso = parts[-1].split(".")[0].upper()
+            return climateCSV(iso, parts[-3], parts[-2]), "text/csv"
+        if parts[0] == "rest":
+            iso = parts[-1].upper()
+            return json.dumps({"alpha3Code" : iso, "population" : population(iso)}), "application/json"
+        if parts[0] == "v2" and parts[1] == "country":
+            indicators = parts[4].split(";")
+            if parts[2] == "all":
+                isos = self.countries
+            else:
+                isos = [parts[2].upper()]
+            date = query.get("date", ["2016"])[0]
+            records = [{"indicator" : {"id" : indicator}, "countryiso3code" : iso, "date" : date, "value" : indicatorValue(iso, indicator)} for indicator in indicators for iso in isos]
+            per_page = int(query.get("per_page", ["50"])[0])
+            page = int(query.get("page", ["1"])[0])
+            pages = max(1, -(-len(records) // per_page))
+            meta = {"page" : page, "pages" : pages, "per_page" : per_page, "total" : len(records)}
+            return json.dumps([meta, records[(page - 1) * per_page : page * per_page]]), "application/json"
+        raise KeyError(parts[0])
+
+class MockServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+# Starts the mock server on a background thread and returns (server, base URL)
+# files maps a path (such as "/cases.csv") to bytes served as-is; server.files can be updated while it runs
+# errorRate is the share of API requests (not files) answered with 503 Service Unavailable, chosen reproducibly from seed
+def startServer(latency = 0.0, port = 0, countries = None, files = None, errorRate = 0.0, seed = 0):
+    settings = {"latency" : latency, "countries" : list(countries or DEFAULT_COUNTRIES), "files" : dict(files or {}), "errorRate" : errorRate, "rng" : random.Random(seed)}
+    handler = type("ConfiguredMockHandler", (MockHandler,), settings)
+    server = MockServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.files = handler.files
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
+
+if __name__ == '__main__':
+    server, base = startServer()
+    print("Mock API server listening on", base)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
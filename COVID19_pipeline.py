@@ -0,0 +1,406 @@
+# Stage pipeline shared by the four COVID19_analysis scripts.
+# Each stage is one of the scripts' functions together with the module globals it reads (inputs) and sets (outputs).
+# Outputs are named artifacts, so stages from different scripts share data: running several analyses together pulls the
+# cases feed and fills each country table only once. Each stage's result is memoized under a fingerprint of its code,
+# its parameters and the fingerprints of its inputs, in memory and on disk, so after a parameter change only the stages
+# downstream of it run again.
+# Usage: python COVID19_pipeline.py temperature latitude gdp gdp-lsrl [--param latResolution=0.5] [--offline] [--snapshot DATE]
+
+import copy
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import time
+import pandas as pd
+import COVID19_cache as cache
+import COVID19_checkpoint as checkpoint
+import COVID19_fetch as fetch
+import COVID19_metrics as metrics
+
+# Where memoized stage outputs are kept between runs
+MEMO_DIR = os.path.join(cache.CACHE_DIR, "pipeline")
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Default values for every parameter a stage can take
+DEFAULT_PARAMS = {
+    "latResolution" : 1.0,
+    "bootstrapResamples" : 10000,
+    "bootstrapWorkers" : None,
+}
+
+# Stage kinds:
+#   source:  always runs (it is cheap, thanks to the response cache); its outputs are fingerprinted by their content
+#   compute: memoized by fingerprint; "expires" (seconds) bounds how long results built from network data are reused
+#   sink:    always runs and produces nothing (plots, snapshots)
+class Stage:
+
+    def __init__(self, name, module, function, inputs = None, outputs = None, params = None, kind = "compute", expires = None):
+        self.name = name
+        self.module = module
+        self.function = function
+        # global name in module -> artifact name
+        self.inputs = inputs or {}
+        self.outputs = outputs or {}
+        # keyword argument of function -> pipeline parameter name
+        self.params = params or {}
+        self.kind = kind
+        self.expires = expires
+
+    def codeDigest(self):
+        func = getattr(self.module, self.function)
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = func.__qualname__
+        return hashlib.sha256(source.encode()).hexdigest()
+
+# Digest of the source of every COVID19_ module. Stages do most of their work in shared helpers (binning, regression,
+# worldbank...), so a change to any of them has to invalidate the memo too, not just a change to the stage function
+_sourceDigest = None
+
+def sourceDigest():
+    global _sourceDigest
+    if _sourceDigest is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("COVID19_") and name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(name.encode() + b"\n" + f.read())
+        _sourceDigest = digest.hexdigest()
+    return _sourceDigest
+
+# Turns a value into something that pickles the same way every run (sets are unordered, and string hashing is randomized)
+def _canonical(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(item) for item in value)
+    if isinstance(value, dict):
+        return sorted((_canonical(key), _canonical(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+# Fingerprint of a value, based on its content
+def contentDigest(value):
+    if isinstance(value, pd.DataFrame):
+        digest = hashlib.sha256(repr([(column, str(dtype)) for column, dtype in value.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index = True).to_numpy().tobytes())
+        return digest.hexdigest()
+    return hashlib.sha256(pickle.dumps(_canonical(value), protocol = 4)).hexdigest()
+
+# Loads only the raw cases from a stored snapshot (every script's snapshot holds them)
+def loadCases(date):
+    import COVID19_store as store
+    global cases
+    cases = store.openSnapshot("cases", date)
+
+# Pulls the JHU daily time series
+def pullTimeSeries():
+    import COVID19_timeseries as timeseries
+    global series
+    print("Pulling COVID-19 time series from the web...")
+    series = timeseries.pullTimeSeries()
+    print("COVID-19 time series retrieved.")
+
+# Turns the time series into the cases table for one date or window
+def timeSeriesCases(date = None, window = None):
+    import COVID19_timeseries as timeseries
+    global cases
+    cases = timeseries.casesOn(series, date, window)
+
+# Pulls the climate table (every month's projected temperature) for every country in the cases table
+# Countries without a projection are listed in an error report and left out by the temperature analyses. Reporting them
+# keeps the table out of the memo, so the next run asks again for just those countries (the rest come from the cache)
+def pullClimateTable():
+    import COVID19_climate as climate
+    import COVID19_countries as countryIds
+    global climateTable
+    climateTable, errors = climate.pullClimateTable(countryIds.countriesWithISO3(cases["Country_Region"])[1])
+    checkpoint.writeErrorReport(checkpoint.errorReportPath("climate"), errors)
+    if len(errors) > 0:
+        print(str(len(errors)), "countries have no climate projection (see " + checkpoint.errorReportPath("climate") + ").")
+
+# Builds the stage table from the four scripts
+# The scripts import this module for their main(), so they are imported here only when a pipeline actually runs
+def buildStages():
+    import COVID19_analysis1 as analysis1
+    import COVID19_analysis2 as analysis2
+    import COVID19_analysis3 as analysis3
+    import COVID19_analysis4 as analysis4
+
+    stages = [
+        # Shared inputs: every script pulls the same cases feed, and the temperature analyses share one climate table
+        Stage("pullCovidData", analysis1, "pullCovidData", outputs = {"cases" : "cases"}, kind = "source"),
+        Stage("pullClimateTable", sys.modules[__name__], "pullClimateTable", inputs = {"cases" : "cases"}, outputs = {"climateTable" : "climate"}, expires = DAY),
+
+        # analysis1: cases by projected March temperature, and by distance from the equator
+        Stage("pullTempData", analysis1, "pullTempData", inputs = {"cases" : "cases", "climateTable" : "climate"}, outputs = {"countries" : "temps.countries", "country_to_temp" : "temps.country_to_temp"}),
+        Stage("tempAnalysis", analysis1, "tempAnalysis", inputs = {"cases" : "cases", "country_to_temp" : "temps.country_to_temp"}, outputs = {"tempData" : "temps.tempData"}),
+        Stage("aggregateTempData", analysis1, "aggregateTempData", inputs = {"tempData" : "temps.tempData"}, outputs = {"agTempData" : "temps.agTempData"}),
+        Stage("plotTempData", analysis1, "plotTempData", inputs = {"agTempData" : "temps.agTempData"}, kind = "sink"),
+        Stage("saveTempSnapshot", analysis1, "saveSnapshot", inputs = {"cases" : "cases", "country_to_temp" : "temps.country_to_temp"}, kind = "sink"),
+        Stage("latitudeAnalysis", analysis1, "latitudeAnalysis", inputs = {"cases" : "cases"}, outputs = {"latData" : "latitude.latData"}, params = {"resolution" : "latResolution"}),
+        Stage("plotLatData", analysis1, "plotLatData", inputs = {"latData" : "latitude.latData"}, kind = "sink"),
+        Stage("latLongAnalysis", analysis1, "latLongAnalysis", inputs = {"cases" : "cases"}, outputs = {"latLongData" : "latitude.latLongData"}, params = {"resolution" : "latResolution"}),
+        Stage("plotLatLongData", analysis1, "plotLatLongData", inputs = {"latLongData" : "latitude.latLongData"}, kind = "sink"),
+
+        # analysis2: proportion diagnosed by projected March temperature
+        Stage("createTemperatureFrame", analysis2, "createDataFrame", inputs = {"cases" : "cases"}, outputs = {"countryData" : "temperature.frame"}),
+        Stage("fillTemperatureFrame", analysis2, "fillDataFrame", inputs = {"cases" : "cases", "countryData" : "temperature.frame", "climateTable" : "climate"}, outputs = {"countryData" : "temperature.countryData"}, expires = DAY),
+        Stage("tempBinAnalysis", analysis2, "tempBinAnalysis", inputs = {"countryData" : "temperature.countryData"}, outputs = {"barTempData" : "temperature.barTempData", "scatTempData" : "temperature.scatTempData"}),
+        Stage("plotScatTempData", analysis2, "plotScatTempData", inputs = {"scatTempData" : "temperature.scatTempData"}, kind = "sink"),
+        Stage("saveTemperatureSnapshot", analysis2, "saveSnapshot", inputs = {"cases" : "cases", "countryData" : "temperature.countryData"}, kind = "sink"),
+
+        # analysis3 and analysis4 build the same GDP table; it is filled once and shared
+        Stage("createGDPFrame", analysis3, "createDataFrame", inputs = {"cases" : "cases"}, outputs = {"countryData" : "gdp.frame"}),
+        Stage("fillGDPFrame", analysis3, "fillDataFrame", inputs = {"cases" : "cases", "countryData" : "gdp.frame"}, outputs = {"countryData" : "gdp.countryData"}, expires = DAY),
+        Stage("plotGDPData", analysis3, "plotCountryData", inputs = {"countryData" : "gdp.countryData"}, kind = "sink"),
+        Stage("saveGDPSnapshot", analysis3, "saveSnapshot", inputs = {"cases" : "cases", "countryData" : "gdp.countryData"}, kind = "sink"),
+        Stage("LSRLAnalysis", analysis4, "LSRLAnalysis", inputs = {"countryData" : "gdp.countryData"}, outputs = {"B" : "gdp.B"}),
+        Stage("bootstrapAnalysis", analysis4, "bootstrapAnalysis", inputs = {"countryData" : "gdp.countryData"}, outputs = {"band" : "gdp.band"}, params = {"numResamples" : "bootstrapResamples", "workers" : "bootstrapWorkers"}),
+        Stage("plotLSRLData", analysis4, "plotCountryData", inputs = {"countryData" : "gdp.countryData", "B" : "gdp.B", "band" : "gdp.band"}, kind = "sink"),
+    ]
+
+    # Used instead of the pull and fill stages when running from a stored snapshot (--snapshot)
+    snapshotStages = [
+        Stage("loadCasesSnapshot", sys.modules[__name__], "loadCases", outputs = {"cases" : "cases"}, params = {"date" : "snapshot"}, kind = "source"),
+        Stage("loadTempSnapshot", analysis1, "loadSnapshot", outputs = {"country_to_temp" : "temps.country_to_temp"}, params = {"date" : "snapshot"}, kind = "source"),
+        Stage("loadTemperatureSnapshot", analysis2, "loadSnapshot", outputs = {"countryData" : "temperature.countryData"}, params = {"date" : "snapshot"}, kind = "source"),
+        Stage("loadGDPSnapshot", analysis3, "loadSnapshot", outputs = {"countryData" : "gdp.countryData"}, params = {"date" : "snapshot"}, kind = "source"),
+    ]
+
+    # Used instead of pulling cases.csv when running on the daily time series (--date, --window)
+    timeSeriesStages = [
+        Stage("pullTimeSeries", sys.modules[__name__], "pullTimeSeries", outputs = {"series" : "series"}, kind = "source"),
+        Stage("timeSeriesCases", sys.modules[__name__], "timeSeriesCases", inputs = {"series" : "series"}, outputs = {"cases" : "cases"}, params = {"date" : "date", "window" : "window"}),
+    ]
+
+    # Each target is the list of sink stages that make it up
+    targets = {
+        "temperature-cases" : ["plotTempData", "saveTempSnapshot"],
+        "latitude" : ["plotLatData"],
+        "latlong" : ["plotLatLongData"],
+        "temperature" : ["plotScatTempData", "saveTemperatureSnapshot"],
+        "gdp" : ["plotGDPData", "saveGDPSnapshot"],
+        "gdp-lsrl" : ["plotLSRLData", "saveGDPSnapshot"],
+    }
+    return stages, snapshotStages, timeSeriesStages, targets
+
+class Pipeline:
+
+    def __init__(self, stages, targets, params = None, persist = True):
+        self.stages = {stage.name : stage for stage in stages}
+        self.targets = targets
+        self.params = dict(DEFAULT_PARAMS)
+        self.params.update(params or {})
+        self.persist = persist
+        # artifact name -> the stage producing it
+        self.producers = {}
+        for stage in stages:
+            for artifact in stage.outputs.values():
+                self.producers[artifact] = stage
+        # artifact name -> (fingerprint, value) for everything computed so far
+        self.artifacts = {}
+        self.memo = {}
+        self.ran = []
+        # One entry per stage run or served from the memo, in order, as recorded by COVID19_metrics.measureStage
+        self.timings = []
+
+    # Replaces the producers of some artifacts (used for snapshot mode)
+    def override(self, stages):
+        for stage in stages:
+            self.stages[stage.name] = stage
+            for artifact in stage.outputs.values():
+                self.producers[artifact] = stage
+
+    # Changes parameters; artifacts depending on them are recomputed on the next run
+    def setParams(self, **params):
+        self.params.update(params)
+
+    def _stageParams(self, stage):
+        return {kwarg : self.params.get(name) for kwarg, name in stage.params.items()}
+
+    def _fingerprint(self, stage, inputFingerprints):
+        parts = [stage.name, stage.codeDigest(), sourceDigest(), repr(sorted(self._stageParams(stage).items())), repr(sorted(inputFingerprints.items()))]
+        if stage.expires:
+            parts.append(str(int(time.time() // stage.expires)))
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def _memoPath(self, fingerprint):
+        return os.path.join(MEMO_DIR, fingerprint + ".pkl")
+
+    def _loadMemo(self, fingerprint):
+        if fingerprint in self.memo:
+            return self.memo[fingerprint]
+        if not self.persist:
+            return None
+        try:
+            with open(self._memoPath(fingerprint), "rb") as f:
+                outputs = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        self.memo[fingerprint] = outputs
+        return outputs
+
+    def _saveMemo(self, fingerprint, outputs):
+        self.memo[fingerprint] = outputs
+        if not self.persist:
+            return
+        os.makedirs(MEMO_DIR, exist_ok = True)
+        path = self._memoPath(fingerprint)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(outputs, f)
+        os.replace(path + ".tmp", path)
+
+    # Binds inputs into the stage's module, calls it, and collects its outputs
+    # Inputs are copied, since the scripts' functions modify the globals they are given in place
+    def _call(self, stage, inputValues):
+        with metrics.measureStage(stage.name) as record:
+            for name, value in inputValues.items():
+                setattr(stage.module, name, copy.deepcopy(value))
+            getattr(stage.module, stage.function)(**self._stageParams(stage))
+        self.ran.append(stage.name)
+        self.timings.append(record)
+        return {name : getattr(stage.module, name) for name in stage.outputs}
+
+    # Makes sure an artifact is up to date and returns its fingerprint
+    def _resolve(self, artifact, active):
+        if artifact in self.artifacts:
+            return self.artifacts[artifact][0]
+        if artifact not in self.producers:
+            raise KeyError("No stage produces " + artifact)
+        self._runStage(self.producers[artifact], active)
+        return self.artifacts[artifact][0]
+
+    def _runStage(self, stage, active = None):
+        active = set() if active is None else active
+        if stage.name in active:
+            raise ValueError("Cycle in pipeline at " + stage.name)
+        active = active | {stage.name}
+
+        inputFingerprints = {name : self._resolve(artifact, active) for name, artifact in stage.inputs.items()}
+        inputValues = {name : self.artifacts[artifact][1] for name, artifact in stage.inputs.items()}
+
+        if stage.kind == "compute":
+            fingerprint = self._fingerprint(stage, inputFingerprints)
+            with metrics.measureStage(stage.name, cached = True) as record:
+                outputs = self._loadMemo(fingerprint)
+                record["kept"] = outputs is not None
+            if outputs is not None:
+                self.timings.append(record)
+            else:
+                failures = checkpoint.failureCount
+                outputs = self._call(stage, inputValues)
+                if checkpoint.failureCount == failures:
+                    self._saveMemo(fingerprint, outputs)
+                else:
+                    # A stage that reported per-country failures is not memoized, so a rerun (with --resume) retries them.
+                    # Its outputs are fingerprinted by content instead, so the stages below it see when a retry fills the gaps
+                    for name, artifact in stage.outputs.items():
+                        self.artifacts[artifact] = (contentDigest(outputs[name]), outputs[name])
+                    return
+            for name, artifact in stage.outputs.items():
+                self.artifacts[artifact] = (fingerprint + ":" + name, outputs[name])
+        elif stage.kind == "source":
+            outputs = self._call(stage, inputValues)
+            for name, artifact in stage.outputs.items():
+                self.artifacts[artifact] = (contentDigest(outputs[name]), outputs[name])
+        else:
+            self._call(stage, inputValues)
+
+    # Runs the named targets, computing each artifact they need at most once
+    # Returns a dictionary of every artifact computed, by name
+    def run(self, targetNames):
+        import COVID19_report as report
+        self.artifacts = {}
+        self.ran = []
+        self.timings = []
+        report.reset()
+        metrics.reset()
+        for target in targetNames:
+            for stageName in self._targetSinks(target):
+                if stageName not in self.ran:
+                    self._runStage(self.stages[stageName])
+        with metrics.measureStage("writeReport"):
+            report.writeReport()
+        return {artifact : value for artifact, (fingerprint, value) in self.artifacts.items()}
+
+    # Computes everything the named targets' sinks would be given, without running the sinks (no plots, no snapshots)
+    # Returns a dictionary of every artifact computed, by name
+    def compute(self, targetNames):
+        self.artifacts = {}
+        self.ran = []
+        self.timings = []
+        metrics.reset()
+        for target in targetNames:
+            for stageName in self._targetSinks(target):
+                for artifact in self.stages[stageName].inputs.values():
+                    self._resolve(artifact, set())
+        return {artifact : value for artifact, (fingerprint, value) in self.artifacts.items()}
+
+    def _targetSinks(self, target):
+        if target not in self.targets:
+            raise KeyError("Unknown target " + target + "; choose from " + ", ".join(sorted(self.targets)))
+        return self.targets[target]
+
+# Builds the pipeline for the four analyses
+# In snapshot mode, the pull and fill stages are replaced by loading the given snapshot, and nothing is snapshotted again
+# In time series mode (a date or window), the cases table comes from the JHU daily time series on that date or window,
+# and is not snapshotted either
+def createPipeline(params = None, snapshot = None, persist = True, date = None, window = None):
+    stages, snapshotStages, timeSeriesStages, targets = buildStages()
+    if snapshot or date or window:
+        targets = {name : [stage for stage in sinks if not stage.startswith("save")] for name, sinks in targets.items()}
+    pipeline = Pipeline(stages, targets, params, persist)
+    if snapshot:
+        pipeline.override(snapshotStages)
+        pipeline.setParams(snapshot = snapshot)
+    if date or window:
+        pipeline.override(timeSeriesStages)
+        pipeline.setParams(date = date, window = window)
+    return pipeline
+
+# Deletes every memoized stage output
+def clearMemo():
+    if not os.path.isdir(MEMO_DIR):
+        return
+    for entry in os.scandir(MEMO_DIR):
+        if entry.name.endswith(".pkl"):
+            os.remove(entry.path)
+
+# Runs the given targets with the command line options shared by the scripts
+def runTargets(targetNames, options, params = None):
+    if options.clear_cache:
+        clearMemo()
+    pipeline = createPipeline(params, options.snapshot, date = options.date, window = options.window)
+    artifacts = pipeline.run(targetNames)
+    metrics.writeOutputs(options)
+    return artifacts
+
+# Parses "name=value" parameter overrides, converting numbers
+def parseParams(pairs):
+    params = {}
+    for pair in pairs or []:
+        name, value = pair.split("=", 1)
+        try:
+            value = float(value) if "." in value else int(value)
+        except ValueError:
+            pass
+        params[name] = value
+    return params
+
+def main():
+
+    extra = [
+        ("targets", {"nargs" : "+", "help" : "analyses to run: temperature-cases, latitude, latlong, temperature, gdp, gdp-lsrl"}),
+        ("--param", {"action" : "append", "metavar" : "NAME=VALUE", "help" : "override a stage parameter, e.g. latResolution=0.5"}),
+    ]
+    options = fetch.parseArgs("Run several COVID-19 analyses, sharing and memoizing their stages.", extraArguments = extra)
+    runTargets(options.targets, options, parseParams(options.param))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Incremental refresh of the JHU cases feed.
+# Revalidates cases.csv with a conditional request and does nothing when it has not changed. When it has, the new snapshot is
+# diffed against the previous one by row key and only the rows that changed are added to or subtracted from the saved aggregates.
+# Usage: python COVID19_refresh.py [--offline] [--full]
+
+import hashlib
+import io
+import os
+import pickle
+import pandas as pd
+import COVID19_aggregate as agg
+import COVID19_binning as binning
+import COVID19_cache as cache
+import COVID19_climate as climate
+import COVID19_countries as countryIds
+import COVID19_fetch as fetch
+import COVID19_ingest as ingest
+
+CASES_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
+
+# Where the previous snapshot and its aggregates are kept between refreshes
+STATE_PATH = os.path.join(cache.CACHE_DIR, "refresh_state.pkl")
+
+# Columns that identify a row of cases.csv, most specific first; the first one present (and unique) is used
+KEY_COLUMNS = ["UID", "Combined_Key", "FIPS"]
+
+# Columns whose change means a row's contribution to the aggregates changed
+TRACKED_COLUMNS = ["Country_Region", "Lat"] + agg.CASE_COLUMNS
+
+# Projected March temperature bins the temperature aggregate is kept in (the 5 degree ranges of analysis1's bar graph)
+TEMPERATURE_BINS = binning.widthResolution(-30, 30, 5, clip = True)
+
+# Maps every country in a cases snapshot to the start of its projected March temperature bin, from the climate table
+# Countries with no projection are left out
+def temperatureBins(cases):
+    names, ISOs = countryIds.countriesWithISO3(cases["Country_Region"])
+    table, errors = climate.pullClimateTable(ISOs)
+    index = binning.binIndex(climate.monthTemps(table, ISOs, "Mar"), TEMPERATURE_BINS)
+    return {name : float(TEMPERATURE_BINS["labels"][i]) for name, i in zip(names, index) if i >= 0}
+
+# Returns the key for every row of a cases snapshot
+def rowKeys(cases):
+    for column in KEY_COLUMNS:
+        if column in cases.columns and cases[column].notna().all() and cases[column].is_unique:
+            return cases[column]
+    return cases["Country_Region"].astype(str) + "|" + cases.get("Province_State", pd.Series("", index = cases.index)).astype(object).fillna("").astype(str)
+
+# Splits the difference between two snapshots into the old rows to subtract and the new rows to add
+# A row whose tracked columns changed appears in both; untouched rows appear in neither
+def diffSnapshots(old, new):
+    old = old.set_axis(rowKeys(old), axis = 0)
+    new = new.set_axis(rowKeys(new), axis = 0)
+    columns = [column for column in TRACKED_COLUMNS if column in old.columns and column in new.columns]
+
+    common = old.index.intersection(new.index)
+    # Compared as plain values: categoricals from two reads have different categories, and with nullable counts a value
+    # that became (or stopped being) missing compares as <NA> rather than as a change
+    before = old.loc[common, columns].astype(object)
+    after = new.loc[common, columns].astype(object)
+    bothMissing = before.isna() & after.isna()
+    differs = (before.ne(after) | before.isna() | after.isna()) & ~bothMissing
+    differs = differs.any(axis = 1)
+    changed = common[differs.to_numpy()]
+
+    removed = old.loc[old.index.difference(new.index).append(changed)]
+    added = new.loc[new.index.difference(old.index).append(changed)]
+    return removed, added
+
+# Aggregates maintained by the refresh: per-country totals, per-degree latitude totals and, if a country -> temperature
+# mapping is given, per-temperature totals
+def computeAggregates(cases, countryToTemp = None):
+    aggregates = {
+        "country" : agg.aggregateCases(cases),
+        "latitude" : binning.latitudeHistogram(cases).set_index("distance")[["numCases"]],
+    }
+    if countryToTemp is not None:
+        aggregates["temperature"] = agg.totalsByKey(aggregates["country"], countryToTemp)
+    return aggregates
+
+# Adds (sign = 1) or subtracts (sign = -1) the contribution of some rows to a set of aggregates
+def applyRows(aggregates, rows, sign, countryToTemp = None):
+    if len(rows.index) == 0:
+        return aggregates
+    delta = computeAggregates(rows, countryToTemp)
+    for name, table in delta.items():
+        aggregates[name] = aggregates[name].add(sign * table, fill_value = 0)
+    return aggregates
+
+# Loads the state saved by the last refresh, or None
+def loadState():
+    try:
+        with open(STATE_PATH, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+def saveState(state):
+    os.makedirs(os.path.dirname(STATE_PATH) or ".", exist_ok = True)
+    with open(STATE_PATH + ".tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+# Brings the cases snapshot and its aggregates up to date
+# With temperatures, countryToTemp is built from the snapshot itself with temperatureBins (a country appearing in or
+# leaving the feed changes it, and so recomputes every aggregate)
+# Returns (cases, aggregates, summary), where summary says whether anything changed and how many rows were touched
+def refreshCases(url = CASES_URL, countryToTemp = None, full = False, temperatures = False):
+    content = fetch.fetchConditional(url)[0]
+    digest = hashlib.sha256(content).hexdigest()
+    state = loadState()
+
+    # Nothing to do if the server says the feed is unchanged, or it sent back the snapshot we already aggregated
+    if state is not None and not full and state["digest"] == digest:
+        # A mapping built by temperatureBins from this same snapshot would be the same one
+        sameMapping = state.get("countryToTemp") is not None if temperatures else state.get("countryToTemp") == countryToTemp
+        if sameMapping:
+            return state["cases"], state["aggregates"], {"changed" : False, "rowsTouched" : 0}
+
+    cases = ingest.readCases(io.BytesIO(content), list(ingest.CASES_DTYPES) + ["Combined_Key"])
+    if temperatures:
+        countryToTemp = temperatureBins(cases)
+    if state is None or full or state.get("countryToTemp") != countryToTemp:
+        aggregates = computeAggregates(cases, countryToTemp)
+        rowsTouched = len(cases.index)
+    else:
+        removed, added = diffSnapshots(state["cases"], cases)
+        aggregates = applyRows(state["aggregates"], removed, -1, countryToTemp)
+        aggregates = applyRows(aggregates, added, 1, countryToTemp)
+        rowsTouched = len(removed.index) + len(added.index)
+
+    saveState({"digest" : digest, "cases" : cases, "aggregates" : aggregates, "countryToTemp" : countryToTemp})
+    return cases, aggregates, {"changed" : True, "rowsTouched" : rowsTouched}
+
+def main():
+
+    options = fetch.parseArgs("Incrementally refresh the JHU cases feed and its aggregates.", extraArguments = [("--full", {"action" : "store_true", "help" : "recompute every aggregate from scratch"})])
+    print("Refreshing COVID-19 data...")
+    cases, aggregates, summary = refreshCases(full = options.full, temperatures = True)
+    if summary["changed"]:
+        print("COVID-19 data changed:", str(summary["rowsTouched"]), "rows re-aggregated.")
+    else:
+        print("COVID-19 data unchanged.")
+    totals = aggregates["country"]
+    print(totals.sort_values("Confirmed", ascending = False).head(10))
+    print("Confirmed cases by projected March temperature:")
+    print(aggregates["temperature"])
+
+if __name__ == '__main__':
+    main()
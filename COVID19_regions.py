@@ -0,0 +1,145 @@
+# Hierarchical index of the regions in a cases snapshot: country -> province/state -> county (Admin2).
+# The rows are sorted once by country, province and county, so every region at every level is one contiguous run of
+# rows. Prefix sums of each measure over that order make any region's totals two lookups and a subtraction, and the
+# regions of each level are kept in the same order, so a region's children (and its parent) are a contiguous range too.
+# Nothing is rescanned after the index is built.
+
+import numpy as np
+import pandas as pd
+import COVID19_binning as binning
+
+# Columns naming the regions at each level, coarsest first
+LEVELS = ["Country_Region", "Province_State", "Admin2"]
+
+# Measures summed for every region
+MEASURES = ["Confirmed", "Deaths", "Population"]
+
+# Region names at one level for every row, as (codes, names) with codes in the sorted order of the names
+# Rows without a name at that level get ""
+def _levelNames(cases, column):
+    if column not in cases.columns:
+        return np.zeros(len(cases.index), dtype = np.int64), np.array([""], dtype = object)
+    values = cases[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.add_categories([""]) if "" not in values.cat.categories else values
+        values = values.fillna("").cat.remove_unused_categories()
+        values = values.cat.reorder_categories(sorted(values.cat.categories))
+        return values.cat.codes.to_numpy(dtype = np.int64), values.cat.categories.to_numpy(dtype = object)
+    codes, names = pd.factorize(values.astype(object).where(values.notna(), "").astype(str), sort = True)
+    return codes.astype(np.int64), np.asarray(names, dtype = object)
+
+# Builds the index for a cases table (as read by COVID19_ingest.readCases)
+# Returns a dictionary holding, for every region id (the regions of each level in sorted order, level after level):
+#   keys: its names, as a tuple (country,), (country, province) or (country, province, county)
+#   level, start, end: its level, and the run of sorted rows it covers
+#   parent, childStart, childEnd: the id of the region above it, and the ids of the regions directly below it
+# plus lookup (keys -> id) and prefix (measure -> prefix sums over the sorted rows)
+def buildRegionIndex(cases):
+    numRows = len(cases.index)
+    levels = [_levelNames(cases, column) for column in LEVELS]
+    order = np.lexsort(tuple(codes for codes, levelNames in reversed(levels)))
+    codes = [levelCodes[order] for levelCodes, levelNames in levels]
+
+    values = {
+        "Confirmed" : cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan),
+        "Deaths" : cases["Deaths"].to_numpy(dtype = np.float64, na_value = np.nan) if "Deaths" in cases.columns else np.zeros(numRows),
+        "Population" : binning.rowPopulation(cases),
+    }
+    prefix = {measure : np.concatenate([[0.0], np.cumsum(np.nan_to_num(values[measure][order]))]) for measure in MEASURES}
+
+    # The rows where a new region starts, at each level
+    starts = []
+    changed = np.zeros(numRows, dtype = bool)
+    if numRows > 0:
+        changed[0] = True
+    for levelCodes in codes:
+        changed[1:] |= levelCodes[1:] != levelCodes[:-1]
+        starts.append(np.flatnonzero(changed))
+
+    keys = []
+    level = []
+    start = []
+    end = []
+    offsets = np.cumsum([0] + [len(levelStarts) for levelStarts in starts])
+    for depth, levelStarts in enumerate(starts):
+        keys += list(zip(*[levels[i][1][codes[i][levelStarts]] for i in range(depth + 1)]))
+        level.append(np.full(len(levelStarts), depth))
+        start.append(levelStarts)
+        end.append(np.append(levelStarts[1:], numRows))
+
+    # Parents are found by where each region starts among the regions one level up; children likewise one level down
+    parent = [np.full(len(starts[0]), -1)]
+    childStart = []
+    childEnd = []
+    for depth in range(len(LEVELS)):
+        if depth > 0:
+            parent.append(np.searchsorted(starts[depth - 1], start[depth], side = "right") - 1 + offsets[depth - 1])
+        if depth < len(LEVELS) - 1:
+            childStart.append(np.searchsorted(starts[depth + 1], start[depth]) + offsets[depth + 1])
+            childEnd.append(np.searchsorted(starts[depth + 1], end[depth]) + offsets[depth + 1])
+        else:
+            childStart.append(np.full(len(starts[depth]), offsets[-1]))
+            childEnd.append(np.full(len(starts[depth]), offsets[-1]))
+
+    return {
+        "keys" : keys,
+        "lookup" : {key : i for i, key in enumerate(keys)},
+        "level" : np.concatenate(level),
+        "start" : np.concatenate(start),
+        "end" : np.concatenate(end),
+        "parent" : np.concatenate(parent),
+        "childStart" : np.concatenate(childStart),
+        "childEnd" : np.concatenate(childEnd),
+        "prefix" : prefix,
+        "offsets" : offsets,
+    }
+
+# The id of a region, from its names (a country, a country and province, or a country, province and county)
+def regionId(index, *names):
+    try:
+        return index["lookup"][tuple(names)]
+    except KeyError:
+        raise KeyError("No region " + " / ".join(names)) from None
+
+# Totals for the regions with the given ids (an int or an array of them), as a dictionary of measure -> values
+# incidence is the proportion of the population confirmed, NaN where the population is unknown
+def _totals(index, ids):
+    start = index["start"][ids]
+    end = index["end"][ids]
+    totals = {measure : prefix[end] - prefix[start] for measure, prefix in index["prefix"].items()}
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        totals["incidence"] = np.where(totals["Population"] > 0, totals["Confirmed"] / totals["Population"], np.nan)
+    return totals
+
+def _table(index, ids):
+    totals = _totals(index, ids)
+    return pd.DataFrame({"region" : [index["keys"][i][-1] for i in ids], **totals}, index = pd.Index(ids, name = "id"))
+
+# Totals for one region: regionTotals(index, "US", "New York") -> {"Confirmed" : ..., "Deaths" : ..., "Population" : ..., "incidence" : ...}
+def regionTotals(index, *names):
+    totals = _totals(index, regionId(index, *names))
+    return {measure : float(value) for measure, value in totals.items()}
+
+# Totals for every region directly below one region (every country, if no names are given), one row each
+def drillDown(index, *names):
+    if len(names) == 0:
+        ids = np.arange(index["offsets"][0], index["offsets"][1])
+    else:
+        region = regionId(index, *names)
+        ids = np.arange(index["childStart"][region], index["childEnd"][region])
+    return _table(index, ids)
+
+# The names of the region directly above one region and its totals, or None for a country
+def rollUp(index, *names):
+    parent = index["parent"][regionId(index, *names)]
+    if parent < 0:
+        return None
+    return index["keys"][parent], regionTotals(index, *index["keys"][parent])
+
+# Totals for every region at a level (0 for countries, 1 for provinces, 2 for counties), one row each
+def regionTable(index, level = 0):
+    ids = np.arange(index["offsets"][level], index["offsets"][level + 1])
+    table = _table(index, ids)
+    for depth in range(level):
+        table.insert(depth, LEVELS[depth], [index["keys"][i][depth] for i in ids])
+    return table
@@ -0,0 +1,144 @@
+# Least squares regression of incidence against many indicators at once.
+# Each indicator gets its own simple regression (incidence = intercept + slope * indicator), but all of them are solved
+# together: the design matrices are stacked into one array and factored with a single batched QR decomposition.
+# This avoids forming and inverting XᵀX, which is badly conditioned when indicators are in the scale of dollars.
+# Supports log transforms and weights (for example population), and reports coefficients, standard errors and R².
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import COVID19_countries as countryIds
+import COVID19_worldbank as wb
+
+# Columns of the table returned by fitIndicators
+FIT_COLUMNS = ["intercept", "slope", "interceptSE", "slopeSE", "r2", "n"]
+
+# Natural log of positive values; anything else becomes missing
+def _log(values):
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return np.where(values > 0, np.log(values), np.nan)
+
+# Fits y against each column of X separately, in one batched solve
+# X is a dataframe (one column per indicator) or an array of shape (rows, indicators); y has one value per row
+# Rows missing an indicator (or, with logX/logY, with a value that is not positive) are left out of that indicator's fit only
+# weights, if given, weight each row's squared residual (rows with zero weight are left out)
+# Returns a dataframe with one row per indicator and the columns in FIT_COLUMNS; fits with fewer than 3 usable rows
+# or an indicator that does not vary are all NaN
+def fitIndicators(X, y, weights = None, logX = False, logY = False):
+    names = list(X.columns) if isinstance(X, pd.DataFrame) else None
+    x = np.asarray(X, dtype = np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    y = np.asarray(y, dtype = np.float64)
+    numRows, numIndicators = x.shape
+    if names is None:
+        names = list(range(numIndicators))
+    if logX:
+        x = _log(x)
+    if logY:
+        y = _log(y)
+    w = np.ones(numRows) if weights is None else np.asarray(weights, dtype = np.float64)
+
+    # Mask of the rows each indicator's fit uses, and the square root of each row's weight within that fit
+    usable = np.isfinite(x) & (np.isfinite(y) & np.isfinite(w) & (w > 0))[:, None]
+    rootWeight = np.where(usable, np.sqrt(np.where(usable, w[:, None], 0)), 0)
+    count = usable.sum(axis = 0)
+
+    # Stacked weighted design matrices (indicators, rows, 2) and responses (indicators, rows)
+    design = np.empty((numIndicators, numRows, 2))
+    design[:, :, 0] = rootWeight.T
+    design[:, :, 1] = (rootWeight * np.where(usable, x, 0)).T
+    response = (rootWeight * np.where(usable, y[:, None], 0)).T
+
+    Q, R = np.linalg.qr(design)
+
+    # Fits whose design is rank deficient are solved against the identity, then blanked out
+    diagonal = np.abs(np.diagonal(R, axis1 = 1, axis2 = 2))
+    degenerate = (count < 3) | (diagonal.min(axis = 1) <= 1e-12 * np.maximum(diagonal.max(axis = 1), 1e-300))
+    R[degenerate] = np.eye(2)
+
+    coefficients = np.linalg.solve(R, np.einsum("knj,kn->kj", Q, response)[:, :, None])[:, :, 0]
+    residuals = response - np.einsum("knj,kj->kn", design, coefficients)
+    rss = (residuals ** 2).sum(axis = 1)
+
+    # R² against the weighted mean of the rows each fit used
+    weightSums = (rootWeight ** 2).sum(axis = 0)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        meanY = (rootWeight.T * response).sum(axis = 1) / weightSums
+        tss = ((response - rootWeight.T * meanY[:, None]) ** 2).sum(axis = 1)
+        r2 = 1 - rss / tss
+
+        # Standard errors from the diagonal of sigma² (RᵀR)⁻¹ = sigma² R⁻¹ R⁻ᵀ
+        sigma2 = rss / (count - 2)
+        Rinv = np.linalg.inv(R)
+        errors = np.sqrt(sigma2[:, None] * (Rinv ** 2).sum(axis = 2))
+
+    fits = pd.DataFrame({
+        "intercept" : coefficients[:, 0],
+        "slope" : coefficients[:, 1],
+        "interceptSE" : errors[:, 0],
+        "slopeSE" : errors[:, 1],
+        "r2" : r2,
+        "n" : count,
+    }, index = pd.Index(names, name = "indicator"))
+    fits.loc[degenerate, FIT_COLUMNS[:-1]] = np.nan
+    return fits
+
+# Screens World Bank indicators as predictors of the proportion of each country diagnosed
+# countryData needs country, density and population columns (as filled by the GDP analyses)
+# Every indicator is pulled for the given year in a few bulk requests and fitted in one batched solve, weighted by population
+# Returns the fits (as fitIndicators), best R² first
+def screenIndicators(countryData, indicators, date = 2016, logX = False, logY = False, weighted = True):
+    values = wb.pullIndicators(indicators, date = date)
+    ISOs = [countryIds.lookupISO3(country).upper() for country in countryData["country"]]
+    X = values.reindex(index = ISOs, columns = indicators)
+    weights = countryData["population"] if weighted else None
+    fits = fitIndicators(X, countryData["density"], weights, logX, logY)
+    return fits.sort_values("r2", ascending = False)
+
+# Fits one straight line per resample, given arrays of shape (resamples, rows)
+# Uses the closed form for a single predictor on centred data, so every resample is solved in the same few array passes
+def _resampleFits(x, y, w):
+    sumW = w.sum(axis = 1)
+    meanX = (w * x).sum(axis = 1) / sumW
+    meanY = (w * y).sum(axis = 1) / sumW
+    dx = x - meanX[:, None]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        slope = (w * dx * (y - meanY[:, None])).sum(axis = 1) / (w * dx * dx).sum(axis = 1)
+    return np.column_stack([meanY - slope * meanX, slope])
+
+# Runs numResamples bootstrap resamples of (x, y, w) with one random stream; called directly or in a worker process
+def _bootstrapChunk(x, y, w, numResamples, seed):
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(x), (numResamples, len(x)))
+    return _resampleFits(x[indices], y[indices], w[indices])
+
+# Bootstraps the straight-line fit of y against x
+# All resamples are drawn as one index array of shape (resamples, rows) and fitted together, without a loop per resample
+# With workers, the resamples are split across a process pool, each process drawing from its own independent random stream
+# Rows missing x, y or weight are dropped first. Returns an array of shape (resamples, 2): intercept and slope of each fit
+def bootstrapFits(x, y, weights = None, numResamples = 10000, seed = 0, workers = None):
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    w = np.ones(len(x)) if weights is None else np.asarray(weights, dtype = np.float64)
+    usable = np.isfinite(x) & np.isfinite(y) & np.isfinite(w) & (w > 0)
+    x, y, w = x[usable], y[usable], w[usable]
+
+    if not workers or workers < 2:
+        return _bootstrapChunk(x, y, w, numResamples, seed)
+
+    sizes = np.full(workers, numResamples // workers)
+    sizes[:numResamples % workers] += 1
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        chunks = pool.map(_bootstrapChunk, [x] * workers, [y] * workers, [w] * workers, sizes, seeds)
+        return np.concatenate(list(chunks))
+
+# Percentile confidence band of the bootstrapped lines over the points xs
+# Returns a dataframe with columns x, lower and upper (level is the share of resampled lines between the two)
+def confidenceBand(fits, xs, level = 0.95):
+    xs = np.asarray(xs, dtype = np.float64)
+    lines = fits[:, :1] + fits[:, 1:] * xs[None, :]
+    tail = (1 - level) / 2 * 100
+    lower, upper = np.nanpercentile(lines, [tail, 100 - tail], axis = 0)
+    return pd.DataFrame({"x" : xs, "lower" : lower, "upper" : upper})
@@ -0,0 +1,122 @@
+# HTML report shared by the plot functions of the COVID19_analysis scripts.
+# Plot functions add their figures here instead of each writing (and overwriting) COVID-19_graphs.html with its own
+# embedded copy of plotly.js. All the figures of a run go into one page, which loads a single local copy of plotly.js
+# kept next to it. Scatter traces too large to draw usefully are thinned first. Nothing here needs a display.
+
+import html
+import os
+import webbrowser
+import numpy as np
+
+REPORT_PATH = "COVID-19_graphs.html"
+
+# Scatter traces with more points than this are thinned to about this many before they are written
+MAX_SCATTER_POINTS = 20000
+
+# Figures added since the report was last reset, as (title, figure) pairs
+figures = []
+
+# Starts a new, empty report
+def reset():
+    figures.clear()
+
+# Adds a figure to the report (plot functions call this in place of write_html or show)
+def addFigure(fig, title = None):
+    if title is None and fig.layout.title.text:
+        title = fig.layout.title.text
+    figures.append((title, fig))
+
+# Keeps at most about maxPoints of a set of points, one per occupied cell of a square grid over their extent
+# Returns the indices kept, in their original order. Dense regions are thinned, outliers and sparse regions are kept
+def thinPoints(x, y, maxPoints = MAX_SCATTER_POINTS):
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    if len(x) <= maxPoints:
+        return np.arange(len(x))
+    cellsPerSide = max(int(np.sqrt(maxPoints)), 1)
+    cells = np.zeros(len(x), dtype = np.int64)
+    for values in (x, y):
+        finite = np.isfinite(values)
+        low = np.min(values, where = finite, initial = np.inf)
+        high = np.max(values, where = finite, initial = -np.inf)
+        span = (high - low) if high > low else 1.0
+        cell = np.clip(((values - low) / span * cellsPerSide).astype(np.int64, copy = False), 0, cellsPerSide - 1)
+        cells = cells * (cellsPerSide + 1) + np.where(finite, cell, cellsPerSide)
+    return np.sort(np.unique(cells, return_index = True)[1])
+
+# Trace properties that hold one value per point and so are thinned along with x and y
+_PER_POINT = ["x", "y", "text", "hovertext", "customdata", "ids"]
+_PER_POINT_MARKER = ["color", "size", "symbol", "opacity"]
+
+def _perPoint(value, numPoints):
+    return value is not None and not isinstance(value, str) and np.ndim(value) > 0 and len(value) == numPoints
+
+# Thins every large scatter trace of a figure in place
+def thinFigure(fig, maxPoints = MAX_SCATTER_POINTS):
+    for trace in fig.data:
+        if trace.type not in ("scatter", "scattergl") or trace.x is None or trace.y is None or len(trace.x) <= maxPoints:
+            continue
+        if trace.mode is not None and "lines" in trace.mode:
+            continue
+        keep = thinPoints(trace.x, trace.y, maxPoints)
+        updates = {}
+        for name in _PER_POINT:
+            if _perPoint(trace[name], len(trace.x)):
+                updates[name] = np.asarray(trace[name])[keep]
+        markerUpdates = {}
+        for name in _PER_POINT_MARKER:
+            if _perPoint(trace.marker[name], len(trace.x)):
+                markerUpdates[name] = np.asarray(trace.marker[name])[keep]
+        if len(markerUpdates) > 0:
+            updates["marker"] = markerUpdates
+        trace.update(updates)
+    return fig
+
+# The plotly.js bundle, written once beside the report and named for its version so upgrades do not reuse a stale copy
+def plotlyAsset(directory):
+    import plotly
+    name = "plotly-" + plotly.__version__ + ".min.js"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        from plotly.offline import get_plotlyjs
+        with open(path + ".tmp", "w", encoding = "utf-8") as f:
+            f.write(get_plotlyjs())
+        os.replace(path + ".tmp", path)
+    return name
+
+# Writes every figure added so far to one HTML page. path may be a file, or a directory (written as index.html inside it)
+# Returns the path of the page written, or None if there were no figures
+def writeReport(path = None):
+    path = path or REPORT_PATH
+    if len(figures) == 0:
+        return None
+    if os.path.isdir(path) or path.endswith(os.sep):
+        os.makedirs(path, exist_ok = True)
+        path = os.path.join(path, "index.html")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok = True)
+    asset = plotlyAsset(directory)
+
+    parts = ["<!DOCTYPE html>", "<html>", "<head>", '<meta charset="utf-8">', "<title>COVID-19 graphs</title>",
+             '<script src="' + asset + '"></script>', "</head>", "<body>"]
+    for title, fig in figures:
+        if title:
+            parts.append("<h2>" + html.escape(str(title)) + "</h2>")
+        parts.append(thinFigure(fig).to_html(full_html = False, include_plotlyjs = False))
+    parts += ["</body>", "</html>"]
+
+    with open(path + ".tmp", "w", encoding = "utf-8") as f:
+        f.write("\n".join(parts))
+    os.replace(path + ".tmp", path)
+    print("Report with " + str(len(figures)) + " graphs written to " + path + ".")
+    return path
+
+# Opens a written report in a browser, if there is one to open it in; on a headless machine this does nothing
+def openReport(path = None):
+    path = path or REPORT_PATH
+    if os.name == "posix" and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY") and not os.path.exists("/usr/bin/open"):
+        return False
+    try:
+        return webbrowser.open("file://" + os.path.abspath(path))
+    except webbrowser.Error:
+        return False
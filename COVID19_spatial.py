@@ -0,0 +1,98 @@
+# Spatial index over the locations (Lat, Long_) of a cases snapshot.
+# Locations are placed on the unit sphere and indexed with a KD-tree, where straight-line (chord) distance orders points
+# exactly as great-circle distance does. Radius and nearest-neighbour queries, and neighbourhood-smoothed incidence for
+# every row at once, then come from the tree instead of comparing every pair of rows. Requires scipy.
+
+import numpy as np
+import pandas as pd
+import COVID19_binning as binning
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Mean radius of the Earth, in km
+EARTH_RADIUS = 6371.0088
+
+def _requireScipy():
+    if cKDTree is None:
+        raise ImportError("The spatial index requires scipy (pip install scipy).")
+
+# Points on the unit sphere for latitudes and longitudes in degrees, as an (n, 3) array
+def unitVectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype = np.float64))
+    lon = np.radians(np.asarray(lon, dtype = np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+# Chord length on the unit sphere for a great-circle distance in km, and back
+def chordLength(distance):
+    return 2 * np.sin(np.minimum(np.asarray(distance, dtype = np.float64) / EARTH_RADIUS, np.pi) / 2)
+
+def greatCircleDistance(chord):
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord, dtype = np.float64) / 2, 0, 1))
+
+# Builds the index for a cases table. Rows without a location are left out
+# Returns a dictionary with the tree, and for each indexed row its position in cases ("rows"), Confirmed and population
+def buildSpatialIndex(cases):
+    _requireScipy()
+    lat = cases["Lat"].to_numpy(dtype = np.float64, na_value = np.nan)
+    lon = cases["Long_"].to_numpy(dtype = np.float64, na_value = np.nan)
+    located = np.isfinite(lat) & np.isfinite(lon)
+    points = unitVectors(lat[located], lon[located])
+    return {
+        "tree" : cKDTree(points),
+        "points" : points,
+        "rows" : np.flatnonzero(located),
+        "numRows" : len(cases.index),
+        "confirmed" : np.nan_to_num(cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan)[located]),
+        "population" : np.nan_to_num(binning.rowPopulation(cases)[located]),
+    }
+
+# Rows within radius km of a point: returns (positions in cases, their distances in km), nearest first
+def rowsWithin(index, lat, lon, radius):
+    point = unitVectors([lat], [lon])[0]
+    found = np.asarray(index["tree"].query_ball_point(point, chordLength(radius)), dtype = np.int64)
+    distance = greatCircleDistance(np.linalg.norm(index["points"][found] - point, axis = 1))
+    order = np.argsort(distance, kind = "stable")
+    return index["rows"][found[order]], distance[order]
+
+# Total confirmed cases and population within radius km of a point
+def casesWithin(index, lat, lon, radius):
+    point = unitVectors([lat], [lon])[0]
+    found = index["tree"].query_ball_point(point, chordLength(radius))
+    return {"Confirmed" : float(index["confirmed"][found].sum()), "Population" : float(index["population"][found].sum()), "rows" : len(found)}
+
+# The k rows nearest a point, as a dataframe of their positions in cases and distances in km, nearest first
+def nearestRows(index, lat, lon, k = 5):
+    k = min(k, len(index["rows"]))
+    chord, found = index["tree"].query(unitVectors([lat], [lon])[0], k = k)
+    found = np.atleast_1d(found)
+    return pd.DataFrame({"row" : index["rows"][found], "distance" : greatCircleDistance(np.atleast_1d(chord))})
+
+# Neighbourhood-smoothed incidence for every row: confirmed cases over population of all rows within radius km
+# (the row itself included). With bandwidth (km), neighbours are weighted by a Gaussian of their distance instead
+# All pairs within the radius are found in one pass over the tree and summed with bincount
+# Returns a dataframe aligned with cases: neighbours, confirmed and population around each row, and their ratio
+# (rows without a location, or with no population around them, get NaN)
+def smoothedIncidence(index, radius = 100, bandwidth = None):
+    tree = index["tree"]
+    pairs = tree.sparse_distance_matrix(tree, chordLength(radius), output_type = "ndarray")
+    weights = np.ones(len(pairs))
+    if bandwidth:
+        weights = np.exp(-0.5 * (greatCircleDistance(pairs["v"]) / bandwidth) ** 2)
+    numPoints = len(index["rows"])
+    neighbours = np.bincount(pairs["i"], minlength = numPoints)
+    confirmed = np.bincount(pairs["i"], weights = weights * index["confirmed"][pairs["j"]], minlength = numPoints)
+    population = np.bincount(pairs["i"], weights = weights * index["population"][pairs["j"]], minlength = numPoints)
+
+    smoothed = pd.DataFrame({
+        "neighbours" : np.zeros(index["numRows"], dtype = np.int64),
+        "confirmed" : np.full(index["numRows"], np.nan),
+        "population" : np.full(index["numRows"], np.nan),
+    })
+    smoothed.loc[index["rows"], "neighbours"] = neighbours
+    smoothed.loc[index["rows"], "confirmed"] = confirmed
+    smoothed.loc[index["rows"], "population"] = population
+    smoothed["incidence"] = binning.binRatio(smoothed["confirmed"], smoothed["population"])
+    return smoothed
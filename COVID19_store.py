@@ -0,0 +1,82 @@
+# Columnar snapshot store for the merged country tables and the raw cases snapshot.
+# Each run writes its tables as uncompressed Arrow IPC files under a directory named for the snapshot date, so later
+# analyses can memory-map them instead of re-downloading and re-parsing CSV and JSON. Requires pyarrow.
+
+import datetime
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+STORE_DIR = os.environ.get("COVID19_STORE_DIR", "covid19_snapshots")
+
+def _requirePyarrow():
+    if pa is None:
+        raise ImportError("The snapshot store requires pyarrow (pip install pyarrow).")
+
+# Today's date in the form snapshots are keyed by
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+# Where one table of one snapshot is stored
+def snapshotPath(name, date):
+    return os.path.join(STORE_DIR, date, name + ".arrow")
+
+# Dates of every stored snapshot, oldest first
+def listSnapshots():
+    if not os.path.isdir(STORE_DIR):
+        return []
+    return sorted(entry.name for entry in os.scandir(STORE_DIR) if entry.is_dir())
+
+# Resolves "latest" (or None) to the newest snapshot holding the named table
+def resolveDate(name, date = None):
+    if date is not None and date != "latest":
+        return date
+    for candidate in reversed(listSnapshots()):
+        if os.path.exists(snapshotPath(name, candidate)):
+            return candidate
+    raise FileNotFoundError("No snapshot holds a " + name + " table.")
+
+# Writes each table in tables (name -> dataframe) to the snapshot for date (today by default), replacing any earlier copy
+# Does nothing but warn if pyarrow is not installed, so a run never fails just because it could not be snapshotted
+def writeSnapshot(tables, date = None):
+    if pa is None:
+        print("pyarrow is not installed; snapshot not saved.")
+        return None
+    date = date or today()
+    os.makedirs(os.path.join(STORE_DIR, date), exist_ok = True)
+    for name, frame in tables.items():
+        table = pa.Table.from_pandas(frame, preserve_index = False)
+        path = snapshotPath(name, date)
+        with pa.OSFile(path + ".tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + ".tmp", path)
+    print("Snapshot saved to " + os.path.join(STORE_DIR, date) + ".")
+    return date
+
+# Opens one table of a snapshot memory-mapped. The Arrow table's buffers point straight into the mapped file
+# Returns a pyarrow Table, or a pandas dataframe if asPandas (which copies only the columns pandas cannot share)
+def openSnapshot(name, date = None, asPandas = True):
+    _requirePyarrow()
+    path = snapshotPath(name, resolveDate(name, date))
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    if asPandas:
+        return table.to_pandas()
+    return table
+
+# Puts one column of a table side by side across snapshots: one row per key, one column per snapshot date
+def compareSnapshots(name, column, dates = None, key = "country"):
+    _requirePyarrow()
+    if dates is None:
+        dates = [date for date in listSnapshots() if os.path.exists(snapshotPath(name, date))]
+    series = {}
+    for date in dates:
+        table = openSnapshot(name, date, asPandas = False).select([key, column]).to_pandas()
+        series[date] = table.set_index(key)[column]
+    return pd.DataFrame(series)
@@ -0,0 +1,196 @@
+# Parameter sweeps over the temperature, latitude and GDP analyses.
+# The inputs every configuration shares (case totals, projected temperatures for every month, World Bank population and GDP
+# for every year in the grid, and the per-row latitudes) are loaded once and placed in shared memory. Each configuration is
+# then run on a process pool, reading those arrays without copying them, and the results are gathered into one tidy table.
+# Usage: python COVID19_sweep.py --month Jan Mar Jul --year 2016 2018 --bin-width 2 5 --lat-resolution 0.5 1 [--workers 8]
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import COVID19_aggregate as agg
+import COVID19_binning as binning
+import COVID19_climate as climate
+import COVID19_countries as countryIds
+import COVID19_fetch as fetch
+import COVID19_ingest as ingest
+import COVID19_metrics as metrics
+import COVID19_regression as regression
+import COVID19_worldbank as wb
+
+CASES_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases.csv"
+
+# The grid run when a parameter is not given: the values the analysis scripts use
+DEFAULT_GRID = {
+    "month" : ["Mar"],
+    "year" : [2016],
+    "binWidth" : [5],
+    "latResolution" : [1.0],
+}
+
+# Columns of the results table: which analysis, the parameters it ran with (NaN for those it does not use),
+# the bin or term the row is about, and one measure of it
+RESULT_COLUMNS = ["analysis", "month", "year", "binWidth", "latResolution", "label", "measure", "value"]
+
+# Loads everything the sweep needs for the given indicator years, as a dictionary of arrays
+# Countries are the rows of confirmed, temps (countries x 12 months, from COVID19_climate), population and gdp (years x countries)
+def loadInputs(years, cases = None):
+    if cases is None:
+        print("Pulling COVID-19 data from the web...")
+        cases = ingest.readCases(io.BytesIO(fetch.fetchURL(CASES_URL)))
+    names, ISOs = countryIds.countriesWithISO3(cases["Country_Region"])
+    confirmed = agg.aggregateCases(cases, names)["Confirmed"].to_numpy(dtype = np.float64)
+
+    temps = climate.monthlyTemps(climate.pullClimateTable(ISOs)[0], ISOs)
+
+    population = np.empty((len(years), len(names)))
+    gdp = np.empty((len(years), len(names)))
+    for i, year in enumerate(years):
+        values = wb.pullIndicators([wb.POPULATION, wb.GDP], date = year).reindex([ISO.upper() for ISO in ISOs])
+        population[i] = values[wb.POPULATION].to_numpy(dtype = np.float64, na_value = np.nan)
+        gdp[i] = values[wb.GDP].to_numpy(dtype = np.float64, na_value = np.nan)
+
+    return {
+        "confirmed" : confirmed,
+        "temps" : temps,
+        "population" : population,
+        "gdp" : gdp,
+        "years" : np.asarray(years, dtype = np.int64),
+        "rowLat" : cases["Lat"].to_numpy(dtype = np.float64, na_value = np.nan),
+        "rowConfirmed" : cases["Confirmed"].to_numpy(dtype = np.float64, na_value = np.nan),
+        "rowPopulation" : binning.rowPopulation(cases),
+    }
+
+# Copies arrays into shared memory blocks
+# Returns the blocks (keep them, and unlink them when done) and a description workers can attach to them with
+def shareArrays(arrays):
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+# The inputs as seen by the current process
+_inputs = {}
+_blocks = []
+
+# Worker initializer: maps the shared blocks into this process as arrays
+def _attach(specs):
+    for name, (blockName, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name = blockName)
+        _blocks.append(block)
+        _inputs[name] = np.ndarray(shape, dtype = np.dtype(dtype), buffer = block.buf)
+
+def _rows(analysis, params, labels, measures):
+    rows = []
+    for measure, values in measures.items():
+        for label, value in zip(labels, values):
+            rows.append((analysis, params.get("month"), params.get("year"), params.get("binWidth"), params.get("latResolution"), label, measure, float(value)))
+    return rows
+
+def _yearIndex(year):
+    return int(np.flatnonzero(_inputs["years"] == year)[0])
+
+# Proportion diagnosed by projected temperature of one month or season, in bins of one width (as barTempData)
+def _temperatureTask(params):
+    temps = _inputs["temps"][:, climate.monthColumns(params["month"])].mean(axis = 1)
+    population = _inputs["population"][_yearIndex(params["year"])]
+    known = np.isfinite(temps) & np.isfinite(population)
+    spec = binning.widthResolution(-30, 30, params["binWidth"], clip = True)
+    sums = binning.binSums(temps[known], {"numCases" : _inputs["confirmed"][known], "population" : population[known]}, spec)
+    density = binning.binRatio(sums["numCases"], sums["population"])
+    return _rows("temperature", params, spec["labels"], {"numCases" : sums["numCases"], "population" : sums["population"], "density" : density})
+
+# Cases and incidence by distance from the equator at one resolution (as latData)
+def _latitudeTask(params):
+    rows = pd.DataFrame({"Lat" : _inputs["rowLat"], "Confirmed" : _inputs["rowConfirmed"], "Population" : _inputs["rowPopulation"]})
+    latData = binning.latitudeHistogram(rows, params["latResolution"])
+    return _rows("latitude", params, latData["distance"], {"numCases" : latData["numCases"], "population" : latData["population"], "incidence" : latData["incidence"]})
+
+# LSRL of proportion diagnosed against GDP per capita, with one year's World Bank data
+def _regressionTask(params):
+    year = _yearIndex(params["year"])
+    population = _inputs["population"][year]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        density = _inputs["confirmed"] / population
+        perCapGDP = _inputs["gdp"][year] / population
+    fit = regression.fitIndicators(perCapGDP, density).iloc[0]
+    return _rows("regression", params, ["perCapGDP"] * len(regression.FIT_COLUMNS), {column : [fit[column]] for column in regression.FIT_COLUMNS})
+
+_TASKS = {
+    "temperature" : _temperatureTask,
+    "latitude" : _latitudeTask,
+    "regression" : _regressionTask,
+}
+
+def _runTask(task):
+    analysis, params = task
+    return _TASKS[analysis](params)
+
+# The configurations to run for a grid. Each analysis is run once per combination of the parameters it uses
+def gridTasks(grid):
+    grid = {**DEFAULT_GRID, **{name : values for name, values in grid.items() if values}}
+    tasks = []
+    for month in grid["month"]:
+        for year in grid["year"]:
+            for width in grid["binWidth"]:
+                tasks.append(("temperature", {"month" : month, "year" : year, "binWidth" : width}))
+    for latResolution in grid["latResolution"]:
+        tasks.append(("latitude", {"latResolution" : latResolution}))
+    for year in grid["year"]:
+        tasks.append(("regression", {"year" : year}))
+    return grid, tasks
+
+# Runs every configuration of a grid (a dictionary of parameter name -> list of values; see DEFAULT_GRID)
+# inputs, if given, are the arrays loadInputs returns for the grid's years; otherwise they are loaded first
+# Configurations run on a pool of workers processes, or in this process if workers is 1
+# Returns a tidy dataframe with the columns in RESULT_COLUMNS
+def runSweep(grid, workers = None, inputs = None):
+    grid, tasks = gridTasks(grid)
+    if inputs is None:
+        with metrics.measureStage("loadInputs"):
+            inputs = loadInputs(grid["year"])
+    workers = workers or os.cpu_count() or 1
+
+    print("Running " + str(len(tasks)) + " configurations...")
+    with metrics.measureStage("runSweep"):
+        if workers == 1:
+            _inputs.update(inputs)
+            results = [_runTask(task) for task in tasks]
+        else:
+            blocks, specs = shareArrays(inputs)
+            try:
+                with ProcessPoolExecutor(max_workers = workers, initializer = _attach, initargs = (specs,)) as pool:
+                    results = list(pool.map(_runTask, tasks, chunksize = max(len(tasks) // (workers * 4), 1)))
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+    print("Sweep complete.")
+    return pd.DataFrame([row for rows in results for row in rows], columns = RESULT_COLUMNS)
+
+def main():
+
+    extra = [
+        ("--month", {"nargs" : "+", "choices" : climate.MONTHS + list(climate.SEASONS), "help" : "months (or seasons: DJF, MAM, JJA, SON) of projected temperature"}),
+        ("--year", {"nargs" : "+", "type" : int, "help" : "World Bank indicator years"}),
+        ("--bin-width", {"nargs" : "+", "type" : float, "dest" : "binWidth", "help" : "temperature bin widths, in degrees"}),
+        ("--lat-resolution", {"nargs" : "+", "type" : float, "dest" : "latResolution", "help" : "latitude band widths, in degrees"}),
+        ("--workers", {"type" : int, "help" : "processes to run configurations on (default: one per CPU)"}),
+        ("--output", {"default" : "COVID-19_sweep.csv", "help" : "where to write the results table"}),
+    ]
+    options = fetch.parseArgs("Run the temperature, latitude and GDP analyses over a grid of parameters.", extraArguments = extra)
+    grid = {"month" : options.month, "year" : options.year, "binWidth" : options.binWidth, "latResolution" : options.latResolution}
+    results = runSweep(grid, options.workers)
+    results.to_csv(options.output, index = False)
+    print("Results written to " + options.output + ".")
+    metrics.writeOutputs(options)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# Daily time series mode, built on the JHU CSSE confirmed cases time series.
+# The series is held as a dense (regions x days) NumPy array, summed into a (countries x days) array, so daily new
+# cases, rolling averages, doubling times and incidence per capita are computed for every country in a few array passes.
+# casesOn turns the series back into a cases table for any date or window, which the analyses can use in place of cases.csv.
+# Usage: python COVID19_timeseries.py [--date 2020-04-01] [--window 7] [--offline]
+
+import io
+import numpy as np
+import pandas as pd
+import COVID19_fetch as fetch
+
+TIMESERIES_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"
+
+# JHU's table of regions, which holds the population of each
+LOOKUP_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/UID_ISO_FIPS_LookUp_Table.csv"
+
+# The time series names its columns differently from cases.csv
+COLUMN_NAMES = {"Province/State" : "Province_State", "Country/Region" : "Country_Region", "Long" : "Long_"}
+REGION_COLUMNS = ["Province_State", "Country_Region", "Lat", "Long_"]
+
+# Default width of rolling windows, in days
+WINDOW = 7
+
+# Sums the rows of a (regions x days) array into one row per group; groups are numbered 0 to numGroups - 1
+def _sumRows(matrix, groups, numGroups):
+    order = np.argsort(groups, kind = "stable")
+    starts = np.searchsorted(groups[order], np.arange(numGroups))
+    return np.add.reduceat(matrix[order], starts, axis = 0)
+
+# Reads a confirmed cases time series (a path or file-like object), and optionally JHU's region lookup table for populations
+# Returns a dictionary with:
+#   regions: one row per region of the series (Province_State, Country_Region, Lat, Long_ and, with a lookup, Population)
+#   dates: the day of each column
+#   confirmed: cumulative confirmed cases, a (regions x days) float64 array
+#   countries, countryIndex: the country names, and the position in countries of each region's country
+#   countryConfirmed, countryPopulation: the same summed per country (population is NaN without a lookup)
+def readTimeSeries(source, lookup = None):
+    table = pd.read_csv(source).rename(columns = COLUMN_NAMES)
+    dateColumns = [column for column in table.columns if column not in REGION_COLUMNS]
+    dates = pd.to_datetime(pd.Index(dateColumns), format = "%m/%d/%y")
+    confirmed = table[dateColumns].to_numpy(dtype = np.float64, na_value = np.nan)
+    confirmed = np.nan_to_num(confirmed)
+    regions = table[REGION_COLUMNS].copy()
+
+    if lookup is not None:
+        populations = pd.read_csv(lookup, usecols = ["Admin2", "Province_State", "Country_Region", "Population"])
+        populations = populations[populations["Admin2"].isna()].drop(columns = "Admin2")
+        populations = populations.drop_duplicates(["Province_State", "Country_Region"])
+        regions = regions.merge(populations, on = ["Province_State", "Country_Region"], how = "left")
+
+    countries, countryIndex = np.unique(regions["Country_Region"].to_numpy(dtype = str), return_inverse = True)
+    countryPopulation = np.full(len(countries), np.nan)
+    if "Population" in regions.columns:
+        population = regions["Population"].to_numpy(dtype = np.float64, na_value = np.nan)
+        countryPopulation = _sumRows(np.nan_to_num(population)[:, None], countryIndex, len(countries))[:, 0]
+        countryPopulation[countryPopulation == 0] = np.nan
+
+    regions["Country_Region"] = regions["Country_Region"].astype("category")
+    regions["Province_State"] = regions["Province_State"].astype("category")
+    return {
+        "regions" : regions,
+        "dates" : dates,
+        "confirmed" : confirmed,
+        "countries" : pd.Index(countries),
+        "countryIndex" : countryIndex,
+        "countryConfirmed" : _sumRows(confirmed, countryIndex, len(countries)),
+        "countryPopulation" : countryPopulation,
+    }
+
+# Pulls the confirmed cases time series (and, if population, the region lookup table) from the JHU CSSE repo
+def pullTimeSeries(url = None, population = True):
+    url = url or TIMESERIES_URL
+    contents = fetch.fetchAll([url, LOOKUP_URL] if population else [url])
+    return readTimeSeries(io.BytesIO(contents[0]), io.BytesIO(contents[1]) if population else None)
+
+# Daily new cases from cumulative counts. Downward corrections in the data are counted as 0 unless clip is False
+def dailyNew(cumulative, clip = True):
+    new = np.diff(cumulative, axis = 1, prepend = 0)
+    return np.maximum(new, 0) if clip else new
+
+# Trailing mean over window days; the first window - 1 days have no mean (NaN), nor does a series shorter than window
+def rollingMean(matrix, window = WINDOW):
+    sums = np.cumsum(matrix, axis = 1)
+    means = np.full(matrix.shape, np.nan)
+    if window > matrix.shape[1]:
+        return means
+    means[:, window - 1] = sums[:, window - 1] / window
+    means[:, window:] = (sums[:, window:] - sums[:, :-window]) / window
+    return means
+
+# Days for cumulative cases to double, at the growth rate over the last window days
+# Infinite where cases did not grow, NaN where there were no cases window days earlier (or not enough history)
+def doublingTime(cumulative, window = WINDOW):
+    times = np.full(cumulative.shape, np.nan)
+    before = cumulative[:, :-window]
+    after = cumulative[:, window:]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        growth = np.log(after / before)
+        times[:, window:] = np.where(before > 0, np.where(growth > 0, window * np.log(2) / growth, np.inf), np.nan)
+    return times
+
+# Cases per "per" people (100000 by default); population has one value per row of matrix
+def perCapita(matrix, population, per = 100000):
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return matrix * per / np.asarray(population, dtype = np.float64)[:, None]
+
+# Computes every derived daily series for every country of a time series at once
+# Returns a dictionary of (countries x days) arrays: confirmed, newCases, rollingNew (window-day mean of new cases),
+# doublingTime, incidence (cumulative cases per 100000) and rollingIncidence (rollingNew per 100000)
+def deriveSeries(series, window = WINDOW):
+    confirmed = series["countryConfirmed"]
+    newCases = dailyNew(confirmed)
+    rollingNew = rollingMean(newCases, window)
+    return {
+        "confirmed" : confirmed,
+        "newCases" : newCases,
+        "rollingNew" : rollingNew,
+        "doublingTime" : doublingTime(confirmed, window),
+        "incidence" : perCapita(confirmed, series["countryPopulation"]),
+        "rollingIncidence" : perCapita(rollingNew, series["countryPopulation"]),
+    }
+
+# Position of a date in the series: the last day on or before it (the last day of all if date is None)
+def dateIndex(series, date = None):
+    if date is None:
+        return len(series["dates"]) - 1
+    position = series["dates"].searchsorted(pd.Timestamp(date), side = "right") - 1
+    if position < 0:
+        raise KeyError("The time series starts on " + str(series["dates"][0].date()) + ", after " + str(date))
+    return int(position)
+
+# One day of a derived series as a table with one row per country
+def countriesOn(series, derived, date = None):
+    day = dateIndex(series, date)
+    table = pd.DataFrame({name : values[:, day] for name, values in derived.items()}, index = series["countries"])
+    table.index.name = "country"
+    return table
+
+# A cases table (as read from cases.csv) for the regions of the time series: Confirmed is the cumulative count on date,
+# or, with window, the cases confirmed in the window days up to and including date
+def casesOn(series, date = None, window = None):
+    day = dateIndex(series, date)
+    confirmed = series["confirmed"][:, day]
+    if window:
+        start = day - window
+        confirmed = confirmed - (series["confirmed"][:, start] if start >= 0 else 0)
+        confirmed = np.maximum(confirmed, 0)
+    cases = series["regions"].copy()
+    cases["Confirmed"] = confirmed
+    return cases
+
+def main():
+
+    options = fetch.parseArgs("Daily growth of COVID-19 cases by country, from the JHU CSSE time series.")
+    print("Pulling COVID-19 time series from the web...")
+    series = pullTimeSeries()
+    print("COVID-19 time series retrieved.")
+    window = options.window or WINDOW
+    table = countriesOn(series, deriveSeries(series, window), options.date)
+    print("Cases on " + str(series["dates"][dateIndex(series, options.date)].date()) + " (" + str(window) + " day averages):")
+    print(table.sort_values("rollingNew", ascending = False).head(20))
+
+if __name__ == '__main__':
+    main()
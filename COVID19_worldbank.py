@@ -0,0 +1,55 @@
+# Bulk retrieval of World Bank indicators.
+# Pulls one or more indicators for every country in a handful of paginated requests and returns a wide ISO3-keyed table.
+
+import json
+import pandas as pd
+import COVID19_fetch as fetch
+
+WORLD_BANK_URL = "http://api.worldbank.org/v2/country/all/indicator/"
+
+# Population and GDP in current US dollars, the indicators used by the GDP analyses
+POPULATION = "SP.POP.TOTL"
+GDP = "NY.GDP.MKTP.CD"
+
+# Largest page the World Bank API will serve
+PER_PAGE = 20000
+
+# Builds the URL for one page of a bulk indicator request
+# Several indicators can be requested at once when they come from the same source (source 2 is World Development Indicators)
+def indicatorURL(indicators, date, page = 1, per_page = None):
+    per_page = per_page or PER_PAGE
+    url = WORLD_BANK_URL + ";".join(indicators) + "?date=" + str(date) + "&format=json&per_page=" + str(per_page) + "&page=" + str(page)
+    if len(indicators) > 1:
+        url = url + "&source=2"
+    return url
+
+# Returns the records from every page of a bulk indicator request
+# The first page tells us how many pages there are; the rest are fetched concurrently
+def pullIndicatorRecords(indicators, date, per_page = None):
+    first = json.loads(fetch.fetchURL(indicatorURL(indicators, date, 1, per_page)))
+    meta = first[0]
+    records = list(first[1] or [])
+    pages = int(meta.get("pages", 1))
+    if pages > 1:
+        urls = [indicatorURL(indicators, date, page, per_page) for page in range(2, pages + 1)]
+        for content in fetch.fetchAll(urls):
+            records.extend(json.loads(content)[1] or [])
+    return records
+
+# Converts World Bank records into a table with one row per ISO3 code and one column per indicator
+def indicatorTable(records):
+    if len(records) == 0:
+        return pd.DataFrame()
+    flat = pd.json_normalize(records)
+    flat = flat[flat["countryiso3code"].fillna("") != ""]
+    table = flat.pivot_table(index = "countryiso3code", columns = "indicator.id", values = "value", aggfunc = "first")
+    table.index.name = "ISO3"
+    table.columns.name = None
+    return table
+
+# Pulls the given indicators for every country for one year, keyed by ISO3 code
+def pullIndicators(indicators, date = 2016):
+    print("Pulling World Bank indicators " + ", ".join(indicators) + " for " + str(date) + "...")
+    table = indicatorTable(pullIndicatorRecords(indicators, date))
+    print("World Bank indicators retrieved.")
+    return table.reindex(columns = list(indicators))